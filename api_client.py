@@ -0,0 +1,134 @@
+import asyncio
+import json
+import logging
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+class ApiError(Exception):
+    pass
+
+class ApiResponse:
+    """
+    A finished response, read in full.
+
+    Mirrors the parts of requests.Response the bot uses: status_code, text,
+    content, headers and json(), so handlers read the same as before.
+    """
+
+    def __init__(self, url, status_code, content, headers, encoding):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.encoding = encoding or "utf-8"
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors="replace")
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise ApiError(f"{self.status_code} Error for url: {self.url}")
+
+def form_fields(values):
+    # (key, value) pairs encoded the way requests encodes data and params:
+    # None is left out, lists repeat the key and everything else is str()'d
+    fields = []
+    for key, value in (values or {}).items():
+        for item in value if isinstance(value, (list, tuple)) else [value]:
+            if item is not None:
+                fields.append((key, item if isinstance(item, str) else str(item)))
+    return fields
+
+class ApiClient:
+    """
+    Shared async HTTP client for the MonsterBot API and media hosts.
+
+    Every host gets its own aiohttp session, so its connections are kept
+    alive and reused across commands, limited to pool_size at once.
+    URLs on any other host, like meme visuals, share one more session.
+    Requests run on the bot's event loop, so a slow API only holds up the
+    commands waiting on it.
+
+    Paths are relative to api_host, or to media_host for media(). user_id
+    adds the ExternalUserId header and bot_secret=True the Bot_Secret one.
+    """
+
+    def __init__(self, api_host, media_host, bot_secret, pool_size=20, timeout=30, keepalive=60):
+        self.hosts = {"api": api_host, "media": media_host}
+        self.bot_secret = bot_secret
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.keepalive = keepalive
+        self.sessions = {}
+
+    def session(self, name):
+        # Created on first use, aiohttp sessions belong to the running loop
+        session = self.sessions.get(name)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit_per_host=self.pool_size, keepalive_timeout=self.keepalive)
+            session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+            self.sessions[name] = session
+        return session
+
+    async def close(self):
+        sessions, self.sessions = list(self.sessions.values()), {}
+        await asyncio.gather(*(session.close() for session in sessions))
+
+    def headers(self, user_id=None, bot_secret=False):
+        headers = {}
+        if bot_secret:
+            headers['Bot_Secret'] = self.bot_secret
+        if user_id is not None:
+            headers['ExternalUserId'] = str(user_id)
+        return headers
+
+    async def request(self, method, url, session="external", user_id=None, bot_secret=False, params=None, data=None, files=None, json=None):
+        """
+        Send one request and read the whole response.
+
+        data and files are sent like requests sends them: data alone as a
+        form, with files as multipart, where files maps a field to a
+        (filename, bytes) tuple.
+        """
+        body = None
+        if files:
+            body = aiohttp.FormData(form_fields(data))
+            for name, (filename, content) in files.items():
+                body.add_field(name, content, filename=filename)
+        elif data is not None:
+            body = form_fields(data)
+            body = aiohttp.FormData(body) if body else None
+
+        async with self.session(session).request(
+            method,
+            url,
+            headers=self.headers(user_id, bot_secret),
+            params=form_fields(params) or None,
+            data=body,
+            json=json,
+        ) as response:
+            content = await response.read()
+            return ApiResponse(str(response.url), response.status, content, response.headers, response.charset)
+
+    async def get(self, path, **kwargs):
+        return await self.request("GET", self.hosts["api"] + path, session="api", **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request("POST", self.hosts["api"] + path, session="api", **kwargs)
+
+    async def put(self, path, **kwargs):
+        return await self.request("PUT", self.hosts["api"] + path, session="api", **kwargs)
+
+    async def delete(self, path, **kwargs):
+        return await self.request("DELETE", self.hosts["api"] + path, session="api", **kwargs)
+
+    async def media(self, path, **kwargs):
+        return await self.request("GET", self.hosts["media"] + path, session="media", **kwargs)
+
+    async def fetch(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
@@ -0,0 +1,98 @@
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+import concurrent.futures
+import contextlib
+import logging
+import threading
+import time
+import requests
+
+logger = logging.getLogger(__name__)
+
+class AssetFetcher:
+    """
+    Shared HTTP client for the images a lottery GIF is built from.
+
+    All requests go through one keep-alive connection pool, no more than
+    max_per_host requests hit the same host at once, and submit_with_deadline
+    bounds how long a whole batch may take.
+    """
+
+    def __init__(self, max_connections=16, max_per_host=4, timeout=(3.05, 10)):
+        self.timeout = timeout
+        self.max_per_host = max_per_host
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix="asset-fetch")
+        self.host_slots = {}
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def host_slot(self, url):
+        host = urlsplit(url).netloc
+        with self.lock:
+            slot = self.host_slots.setdefault(host, threading.BoundedSemaphore(self.max_per_host))
+        with slot:
+            yield
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        with self.host_slot(url):
+            return self.session.get(url, **kwargs)
+
+    def submit(self, fn, *args):
+        return self.executor.submit(fn, *args)
+
+    def submit_with_deadline(self, fn, items, deadline, placeholder, ready=None):
+        """
+        Start fn over items on the shared pool without waiting for them.
+
+        Returns one DeadlineResult per item, all sharing the same deadline, so
+        callers can pick up each result as soon as they need it. Items that
+        fail, return None or are still running after deadline seconds resolve
+        to placeholder(item). Late calls keep running and can still warm caches.
+        ready(item) may return a value at hand, which settles that item without
+        going through the pool.
+        """
+        deadline_at = time.monotonic() + deadline
+        results = []
+        for item in items:
+            value = ready(item) if ready else None
+            if value is not None:
+                future = concurrent.futures.Future()
+                future.set_result(value)
+            else:
+                future = self.executor.submit(fn, item)
+            results.append(DeadlineResult(future, item, deadline_at, placeholder))
+        return results
+
+class DeadlineResult:
+    # Settles once, so every caller sees the same value even if the
+    # underlying call finishes after the deadline handed out a placeholder
+    def __init__(self, future, item, deadline_at, placeholder):
+        self.future = future
+        self.item = item
+        self.deadline_at = deadline_at
+        self.placeholder = placeholder
+        self.lock = threading.Lock()
+        self.settled = False
+        self.value = None
+
+    def done(self):
+        return self.settled or self.future.done()
+
+    def result(self):
+        with self.lock:
+            if not self.settled:
+                result = None
+                try:
+                    result = self.future.result(timeout=max(0, self.deadline_at - time.monotonic()))
+                except concurrent.futures.TimeoutError:
+                    logger.warning(f"Gave up waiting for {self.item}")
+                except Exception as e:
+                    logger.warning(f"Failed to fetch {self.item}: {e}")
+                self.value = result if result is not None else self.placeholder(self.item)
+                self.settled = True
+            return self.value
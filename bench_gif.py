@@ -0,0 +1,208 @@
+"""
+Benchmarks for the stages of the lottery GIF pipeline.
+
+Serves the images in golden/fixtures from a local HTTP server and times
+preprocess_thumbnails_from_urls, create_crate_unboxing_gif,
+extend_gif_with_confetti_and_text, save_gif, parallel_save_gif and
+save_animation in every other output format on their own, across item
+counts, fps values and rarity levels. Every measurement
+records wall time, CPU time, peak RSS growth and output bytes.
+
+    python bench_gif.py                    # run and compare with the baseline
+    python bench_gif.py --save-baseline    # run and store the results as baseline
+    python bench_gif.py --quick            # smallest case of every stage only
+
+Timings are the fastest of --repeat runs. Regressions over --threshold
+percent are flagged and make the script exit 1.
+"""
+# golden_check points the thumbnail cache at a temporary directory, so it
+# has to be imported before gif
+from golden_check import RARITY_COLORS, serve_fixtures
+import argparse
+import gc
+import itertools
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import gif
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+ITEM_COUNTS = [4, 8, 16]
+FPS_VALUES = [10, 20]
+# Winner weight against the others' 100, rarer winners get more confetti
+RARITY_LEVELS = {"common": 100, "rare": 2}
+
+class PeakRSS:
+    # Samples the resident set size while a stage runs. Linux only, elsewhere
+    # it falls back to the process-wide peak from getrusage.
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.peak = 0
+        self.start = 0
+        self.running = False
+
+    def rss(self):
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except OSError:
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def sample(self):
+        while self.running:
+            self.peak = max(self.peak, self.rss())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.start = self.peak = self.rss()
+        self.running = True
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.running = False
+        self.thread.join()
+        self.peak = max(self.peak, self.rss())
+
+    @property
+    def growth(self):
+        return self.peak - self.start
+
+def measure(fn):
+    # Runs fn once, returns its result and wall, CPU and peak RSS growth
+    gc.collect()
+    with PeakRSS() as rss:
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        result = fn()
+        cpu = time.process_time() - cpu_start
+        wall = time.perf_counter() - wall_start
+    return result, {"wall": wall, "cpu": cpu, "rss": rss.growth}
+
+def output_bytes(result):
+    if isinstance(result, tuple):
+        result = result[0]
+    if hasattr(result, "getbuffer"):
+        return len(result.getbuffer())
+    if isinstance(result, list) and result and hasattr(result[0], "width"):
+        # Raw frames, counted as the pixels they hold
+        return sum(len(frame.getbands()) * frame.width * frame.height for frame in result)
+    return 0
+
+def bench_case(base_url, item_count, fps, rarity, repeat, case_number):
+    """
+    Time every stage for one combination of item count, fps and rarity.
+
+    Each stage gets the output of the one before it as input, prepared
+    outside the timed part. Returns {stage: metrics}.
+    """
+    colors = [RARITY_COLORS[i % len(RARITY_COLORS)] for i in range(item_count)]
+    winner_weight = RARITY_LEVELS[rarity]
+    computed_rarity = (1.0 - winner_weight / (100 * item_count + winner_weight)) * 10
+    frame_duration = int(1000 / fps)
+    target_index = item_count // 2
+    results = {}
+
+    def record(stage, fn):
+        best = None
+        for run in range(repeat):
+            result, metrics = measure(lambda: fn(run))
+            metrics["bytes"] = output_bytes(result)
+            if best is None or metrics["wall"] < best["wall"]:
+                best = metrics
+        results[stage] = best
+        return result
+
+    # Unique URLs per run, so every run fetches and prepares cold. The seed
+    # is fixed per case, so every run draws the same animation.
+    thumbnails = record("preprocess", lambda run: gif.preprocess_thumbnails_from_urls([
+        f"{base_url}item{i % 6}.png?case={case_number}&run={run}&item={i}" for i in range(item_count)
+    ]))
+    spin_frames, winner_position = record("spin", lambda run: gif.create_crate_unboxing_gif(
+        thumbnails * gif.CAROUSEL_REPEATS, colors * gif.CAROUSEL_REPEATS, target_index, spin_duration=gif.SPIN_DURATION, fps=fps, rng=case_number
+    ))
+    # extend_gif_with_confetti_and_text appends to the list it is given
+    frames = record("confetti", lambda run: gif.extend_gif_with_confetti_and_text(
+        list(spin_frames), 5 * fps, "WINNER!!!", "Benchmark item", computed_rarity, colors[target_index],
+        f"{base_url}item{target_index % 6}.png", winner_position, frame_duration, rng=case_number
+    ))
+    palette_image = gif.build_gif_palette(thumbnails, colors, gif.hex_to_rgb(colors[target_index]))
+    record("save_gif", lambda run: gif.save_gif(frames, palette_image, frame_duration))
+    record("parallel_save_gif", lambda run: gif.parallel_save_gif(frames, frame_duration))
+    for output_format in gif.OUTPUT_FORMATS:
+        if output_format != "gif":
+            record(f"save_{output_format}", lambda run: gif.save_animation(frames, palette_image, output_format, frame_duration))
+    return results
+
+def compare(results, baseline, threshold):
+    # Prints every measurement next to its baseline, returns the regressions
+    regressions = []
+    print(f"{'case':<24} {'stage':<18} {'wall s':>8} {'cpu s':>8} {'rss MB':>8} {'bytes':>10}  vs baseline")
+    for case, stages in results.items():
+        for stage, metrics in stages.items():
+            before = baseline.get(case, {}).get(stage)
+            changes = []
+            if before:
+                for key in ("wall", "cpu", "rss", "bytes"):
+                    if before[key]:
+                        change = (metrics[key] - before[key]) / before[key] * 100
+                        changes.append(f"{key} {change:+.0f}%")
+                        # Memory and size are noisy below a few hundred KB
+                        if change > threshold and (key in ("wall", "cpu") or metrics[key] - before[key] > 256 * 1024):
+                            regressions.append(f"{case} {stage} {key} {change:+.0f}%")
+            print(
+                f"{case:<24} {stage:<18} {metrics['wall']:>8.3f} {metrics['cpu']:>8.3f} "
+                f"{metrics['rss'] / 2 ** 20:>8.1f} {metrics['bytes']:>10}  {', '.join(changes) or '-'}"
+            )
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline file to compare with or save to")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the fastest one counts")
+    parser.add_argument("--threshold", type=float, default=10, help="percent slower or bigger that counts as a regression")
+    parser.add_argument("--quick", action="store_true", help="only the smallest case")
+    args = parser.parse_args()
+
+    cases = list(itertools.product(ITEM_COUNTS, FPS_VALUES, RARITY_LEVELS))
+    if args.quick:
+        cases = cases[:1]
+
+    server, base_url = serve_fixtures()
+    results = {}
+    try:
+        for case_number, (item_count, fps, rarity) in enumerate(cases):
+            case = f"{item_count} items {fps} fps {rarity}"
+            results[case] = bench_case(base_url, item_count, fps, rarity, args.repeat, case_number)
+    finally:
+        server.shutdown()
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        compare(results, {}, args.threshold)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    else:
+        print(f"No baseline at {args.baseline}, run with --save-baseline to create one")
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print("Regressions:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,145 @@
-from PIL import Image, ImageDraw
+from PIL import Image, ImageDraw, ImageFont
+import numpy as np
 import random
+import math
+import functools
+import itertools
 import time
 import io
 import concurrent.futures
-import requests
+import queue
+import threading
+from PIL import GifImagePlugin
+import os
+import logging
+from asset_fetcher import AssetFetcher
+from render_profile import RenderProfile
+from thumbnail_cache import ThumbnailCache
 
-def generate_similar_color(base_color, variation=150):
+logger = logging.getLogger(__name__)
+
+BACKGROUND_COLOR = (30, 30, 30)
+HIGHLIGHT_COLOR = (255, 215, 0)
+NEEDLE_COLOR = (255, 0, 0)
+TEXT_COLOR = (255, 255, 255)
+
+# Frames buffered between two pipeline stages, which bounds memory per draw
+FRAMES_IN_FLIGHT = 8
+
+# Animation formats generate_gif can encode to, all written by Pillow. GIF
+# is streamed by write_gif, the others need every frame before encoding.
+OUTPUT_FORMATS = {
+    "gif": {"extension": "gif"},
+    "webp": {"extension": "webp", "format": "WEBP", "params": {"lossless": False, "quality": 80, "method": 4}},
+    "webp_lossless": {"extension": "webp", "format": "WEBP", "params": {"lossless": True, "quality": 0, "method": 0}},
+    "apng": {"extension": "png", "format": "PNG", "params": {}},
+}
+OUTPUT_FORMAT = os.getenv('GIF_OUTPUT_FORMAT', 'gif')
+# Checked here rather than when a paid draw gets to encoding
+if OUTPUT_FORMAT not in OUTPUT_FORMATS:
+    raise ValueError(f"Unknown GIF_OUTPUT_FORMAT {OUTPUT_FORMAT!r}, expected one of {tuple(OUTPUT_FORMATS)}")
+
+# generate_gif degrades the animation to stay under these, Discord rejects
+# attachments over 10 MB
+BYTE_BUDGET = int(os.getenv('GIF_BYTE_BUDGET', str(8 * 1024 * 1024)))
+TIME_BUDGET = float(os.getenv('GIF_TIME_BUDGET', '15'))
+SPIN_DURATION = 5
+# The carousel shows the lottery's items this many times over
+CAROUSEL_REPEATS = 16
+
+# Named output sizes, as a scale of the standard 400x200 layout
+LAYOUT_TIERS = {"preview": 0.5, "standard": 1.0, "showcase": 2.0}
+
+asset_fetcher = AssetFetcher()
+# Palettes are CPU work, kept off the download threads and their deadlines
+palette_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="gif-palette")
+
+# Lottery item sets rarely change, so ready tiles are kept between draws
+thumbnail_cache = ThumbnailCache(
+    os.getenv('THUMBNAIL_CACHE_DIR', '.cache/thumbnails'),
+    session=asset_fetcher,
+    timeout=asset_fetcher.timeout,
+)
+
+def resolve(value):
+    # Pipeline stages hand each other pending results, plain values pass through
+    return value.result() if hasattr(value, "result") else value
+
+def as_rng(rng=None):
+    # Renderers take a seed or a random.Random, None keeps the global random
+    if rng is None:
+        return random
+    if isinstance(rng, int):
+        return random.Random(rng)
+    return rng
+
+def iterate_in_background(iterable, maxsize=None):
+    """
+    Run a frame generator on its own thread, handing frames over through a
+    bounded queue so the consumer (the encoder) works while the next frames
+    are drawn. Errors in the generator are raised in the consumer.
+    """
+    items = queue.Queue(maxsize or FRAMES_IN_FLIGHT)
+    stopped = threading.Event()
+    finished = object()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((finished, None))
+        except Exception as e:
+            put((finished, e))
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is finished:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stopped.set()
+
+def spin_layout(scale=1.0, frame_size=(400, 200)):
+    # Pixel sizes of every part of the animation. The numbers are those of the
+    # standard layout, so scale 1.0 draws exactly what it always did.
+    def px(value):
+        return max(1, round(value * scale))
+    return {
+        "scale": scale,
+        "frame_size": (px(frame_size[0]), px(frame_size[1])),
+        "tile_size": (px(100), px(100)),
+        "item_spacing": px(105),
+        "bar_height": px(25),
+        "highlight_margin": px(5),
+        "highlight_width": px(3),
+        "needle_width": px(10),
+        "needle_top": px(10),
+        "needle_tip": px(50),
+        "top_text_y": px(10),
+        "bottom_text_y": px(30),
+        "font_size": px(10),
+        "confetti_radius": px(2),
+    }
+
+def generate_similar_color(base_color, variation=150, rng=random):
     def clamp(value, min_value=0, max_value=255):
         return max(min_value, min(value, max_value))
     return tuple(
-        clamp(channel + random.randint(-variation, variation))
+        clamp(channel + rng.randint(-variation, variation))
         for channel in base_color
     )
 
@@ -17,75 +147,289 @@ def hex_to_rgb(hex_color: str) -> tuple[int, int, int]:
     hex_color = hex_color.lstrip('#')
     return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
 
-def extend_gif_with_confetti_and_text(frames, extension_frames, top_text, bottom_text, rarity, rarity_color, winner_picture_url, winner_position):
-    last_frame = frames[-1]
+@functools.lru_cache(maxsize=64)
+def rarity_bar_sprite(rarity_color, width=101, bar_height=25):
+    # Faded bar, transparent at the top to solid at the bottom. The one pixel
+    # rectangles overlap, so the strip is one row taller than bar_height.
+    bar = Image.new('RGBA', (width, bar_height + 1), (0, 0, 0, 0))
+    bar_draw = ImageDraw.Draw(bar)
+    rarity_rgb = hex_to_rgb(rarity_color)
+    for gradient_step in range(bar_height):
+        alpha = int((gradient_step / bar_height) * 255)  # 0 at top to 255 at bottom
+        bar_draw.rectangle(
+            [0, gradient_step, width - 1, gradient_step + 1],
+            fill=rarity_rgb + (alpha,)
+        )
+    return bar
+
+def make_item_sprite(image, rarity_color, tile_size=None, bar_height=25):
+    # Item tile with the rarity bar composited once, so frames only need a
+    # single masked paste. The bar spills one pixel right and below the tile.
+    # Images of another size than tile_size are resized to it.
+    image = image.convert('RGB')
+    tile_size = tile_size or image.size
+    if image.size != tile_size:
+        image = image.resize(tile_size)
+    sprite = Image.new('RGBA', (tile_size[0] + 1, tile_size[1] + 1), (0, 0, 0, 0))
+    sprite.paste(image, (0, 0))
+    bar = rarity_bar_sprite(rarity_color, tile_size[0] + 1, bar_height)
+    sprite.alpha_composite(bar, (0, tile_size[1] - bar_height))
+    return sprite
+
+def build_item_sprites(images, rarity_colors):
+    # The carousel repeats the same thumbnails many times, share their sprites
+    cache = {}
+    sprites = []
+    for image, rarity_color in zip(images, rarity_colors):
+        key = (id(image), rarity_color)
+        if key not in cache:
+            cache[key] = make_item_sprite(image, rarity_color)
+        sprites.append(cache[key])
+    return sprites
+
+def nearest_palette_indices(colors, palette_image):
+    # Maps an (n, 3) array of RGB colours to their closest palette entries
+    colors = np.asarray(colors, dtype=np.uint8).reshape(-1, 3)
+    if len(colors) == 0:
+        return np.zeros(0, dtype=np.uint8)
+    swatch = Image.fromarray(colors.reshape(1, -1, 3), "RGB")
+    return np.asarray(swatch.quantize(palette=palette_image, dither=Image.Dither.NONE))[0].copy()
+
+def indexed_palette(palette_image):
+    # Everything draw_spin_frame needs to draw straight onto palette_image
+    background, highlight, needle = nearest_palette_indices(
+        [BACKGROUND_COLOR, HIGHLIGHT_COLOR, NEEDLE_COLOR], palette_image
+    ).tolist()
+    return {
+        "image": palette_image,
+        "colors": palette_image.getpalette(),
+        "background": background,
+        "highlight": highlight,
+        "needle": needle,
+    }
+
+def make_indexed_sprite(sprite, palette_image):
+    # A palette image can't blend, so the sprite is flattened over the
+    # background and mapped onto the palette once. The mask keeps the
+    # see-through parts of the bar spill from covering what is underneath.
+    flattened = Image.new("RGB", sprite.size, BACKGROUND_COLOR)
+    flattened.paste(sprite, (0, 0), sprite)
+    indexed = flattened.quantize(palette=palette_image, dither=Image.Dither.NONE)
+    mask = sprite.getchannel("A").point(lambda alpha: 255 if alpha else 0)
+    return indexed, mask
+
+def spawn_confetti(density, origin_x, origin_y, base_color, speed=1.0, rng=random):
+    # Structure of arrays so every particle can be stepped at once
+    velocities = speed * np.array(
+        [(rng.uniform(-6, 6), rng.uniform(-10, -6)) for _ in range(density)], dtype=np.float64
+    ).reshape(density, 2)
+    return {
+        "x": np.full(density, origin_x, dtype=np.float64),
+        "y": np.full(density, origin_y, dtype=np.float64),
+        "vx": velocities[:, 0].copy(),
+        "vy": velocities[:, 1].copy(),
+        "color": np.array(
+            [generate_similar_color(base_color, rng=rng) for _ in range(density)], dtype=np.uint8
+        ).reshape(density, 3),
+    }
+
+def step_confetti(confetti, width, height, gravity=0.3):
+    confetti["x"] += confetti["vx"]
+    confetti["y"] += confetti["vy"]
+    confetti["vy"] += gravity
+    confetti["x"] %= width
+    confetti["y"] %= height
+
+@functools.lru_cache(maxsize=8)
+def confetti_dot_offsets(radius=2):
+    # Pixel offsets of a pre-rendered dot, the same shape draw.ellipse produced
+    size = radius * 2 + 1
+    dot = Image.new('L', (size, size), 0)
+    ImageDraw.Draw(dot).ellipse((0, 0, size - 1, size - 1), fill=255)
+    dy, dx = np.nonzero(np.asarray(dot))
+    return tuple(zip((dy - radius).tolist(), (dx - radius).tolist()))
+
+def stamp_confetti(frame_array, confetti, dot_offsets):
+    # One vectorised write per dot pixel instead of one ellipse per particle
+    height, width = frame_array.shape[:2]
+    particle_x = confetti["x"].astype(np.intp)
+    particle_y = confetti["y"].astype(np.intp)
+    colors = confetti["color"]
+    for dy, dx in dot_offsets:
+        xs = particle_x + dx
+        ys = particle_y + dy
+        inside = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+        frame_array[ys[inside], xs[inside]] = colors[inside]
+
+def render_text_mask(size, texts, font_size=10):
+    # White text is pasted through this mask, which matches draw.text output
+    mask = Image.new('L', size, 0)
+    mask_draw = ImageDraw.Draw(mask)
+    font = ImageFont.load_default(font_size)
+    for position, text in texts:
+        mask_draw.text(position, text, fill=255, anchor="mm", font=font)
+    text_box = mask.getbbox()
+    if text_box is None:
+        return None, None
+    return text_box, mask.crop(text_box)
+
+def extend_gif_with_confetti_and_text(frames, extension_frames, top_text, bottom_text, rarity, rarity_color, winner_picture_url, winner_position, frame_duration=50, scale=1.0, rng=None):
+    frames.extend(iter_confetti_frames(
+        frames[-1],
+        extension_frames,
+        top_text,
+        bottom_text,
+        rarity,
+        rarity_color,
+        fetch_image_from_url(winner_picture_url),
+        winner_position,
+        frame_duration,
+        scale=scale,
+        rng=rng
+    ))
+    return frames
+
+def iter_confetti_frames(last_frame, extension_frames, top_text, bottom_text, rarity, rarity_color, winner_image, winner_position, frame_duration=50, palette_image=None, scale=1.0, rng=None):
+    # winner_image may still be downloading, it is only waited for here. With
+    # palette_image the frames are drawn as "P" straight on that palette.
+    # scale must match the one the spin was drawn at.
+    layout = spin_layout(scale)
+    rng = as_rng(rng)
+    last_frame = last_frame.convert("RGB")
     width, height = last_frame.size
     base_color = hex_to_rgb(rarity_color)
     density = int((30 * rarity) + 5)
     
-    # Fetch and prepare the winner picture
-    winner_image = fetch_image_from_url(winner_picture_url)
+    # Prepare the winner picture
+    winner_image = resolve(winner_image)
     if winner_image:
         # Resize to fit nicely in the frame
-        winner_image = winner_image.resize((100, 100))
+        winner_image = winner_image.resize(layout["tile_size"])
+    winner_sprite = make_item_sprite(winner_image, rarity_color, bar_height=layout["bar_height"]) if winner_image else None
     
-    confetti = [
-        {
-            "x": width // 2,
-            "y": (height // 2)+(height * 0.4),
-            "vx": random.uniform(-6, 6),
-            "vy": random.uniform(-10, -6),
-            "color": generate_similar_color(base_color),
-        }
-        for _ in range(density)
-    ]
+    confetti = spawn_confetti(density, width // 2, (height // 2) + (height * 0.4), base_color, speed=scale, rng=rng)
+    dot_offsets = confetti_dot_offsets(layout["confetti_radius"])
+
+    # Everything but the confetti is identical across frames, so the static
+    # layers are composed once: the last spin frame, the same frame with the
+    # winner picture swapped in, and the text drawn on top of the confetti.
+    spin_layer = np.array(last_frame)
+    winner_layer = spin_layer
+    if winner_sprite and winner_position:
+        winner_frame = last_frame.copy()
+        winner_frame.paste(winner_sprite, winner_position, winner_sprite)
+        winner_layer = np.array(winner_frame)
+    text_box, text_mask = render_text_mask(last_frame.size, [
+        ((width // 2, layout["top_text_y"]), top_text),
+        ((width // 2, height - layout["bottom_text_y"]), bottom_text),
+    ], layout["font_size"])
+    gravity = 0.3 * scale
+
+    if palette_image is not None:
+        yield from iter_indexed_confetti_frames(
+            spin_layer, winner_layer, text_box, text_mask, confetti, dot_offsets, extension_frames, frame_duration, palette_image, gravity
+        )
+        return
 
     for frame_idx in range(extension_frames):
-        confetti_frame = last_frame.copy()
-        draw = ImageDraw.Draw(confetti_frame)
-        
         # After first frame, replace thumbnail with full picture at exact winner position
-        if frame_idx > 0 and winner_image and winner_position:
-            confetti_frame.paste(winner_image, winner_position)
-            
-            # Redraw the rarity bar below the winner image using overlay
-            overlay = Image.new('RGBA', confetti_frame.size, (0, 0, 0, 0))
-            overlay_draw = ImageDraw.Draw(overlay)
-            
-            rarity_rgb = hex_to_rgb(rarity_color)
-            bar_height = 25
-            bar_y_top = winner_position[1] + 100 - bar_height
-            
-            for gradient_step in range(bar_height):
-                alpha = int((gradient_step / bar_height) * 255)  # 0 at top to 255 at bottom
-                color_with_alpha = rarity_rgb + (alpha,)
-                overlay_draw.rectangle(
-                    [winner_position[0], bar_y_top + gradient_step, winner_position[0] + 100, bar_y_top + gradient_step + 1],
-                    fill=color_with_alpha
-                )
-            
-            # Composite the overlay onto the frame
-            confetti_frame = confetti_frame.convert('RGBA')
-            confetti_frame = Image.alpha_composite(confetti_frame, overlay)
-            confetti_frame = confetti_frame.convert('RGB')
-            draw = ImageDraw.Draw(confetti_frame)
-        
-        for particle in confetti:
-            particle["x"] += particle["vx"]
-            particle["y"] += particle["vy"]
-            particle["vy"] += 0.3
-            particle["x"] %= width
-            particle["y"] %= height
-            draw.ellipse(
-                (particle["x"] - 2, particle["y"] - 2, particle["x"] + 2, particle["y"] + 2),
-                fill=particle["color"]
-            )
-        
-        draw.text((width // 2, 10), top_text, fill="white", anchor="mm")
-        draw.text((width // 2, height - 30), bottom_text, fill="white", anchor="mm")
-        frames.append(confetti_frame)
-    
-    return frames
+        frame_array = (winner_layer if frame_idx > 0 else spin_layer).copy()
+        step_confetti(confetti, width, height, gravity)
+        stamp_confetti(frame_array, confetti, dot_offsets)
+        confetti_frame = Image.fromarray(frame_array)
+        if text_mask:
+            confetti_frame.paste(TEXT_COLOR, text_box, text_mask)
+        confetti_frame.info["duration"] = frame_duration
+        yield confetti_frame
+
+def iter_indexed_confetti_frames(spin_layer, winner_layer, text_box, text_mask, confetti, dot_offsets, extension_frames, frame_duration, palette_image, gravity=0.3):
+    # Palette version of the confetti loop. Both static layers are mapped onto
+    # the palette once, with and without the text. The text pixels are copied
+    # back over the confetti, which keeps the antialiased edges of the text.
+    height, width = spin_layer.shape[:2]
+    palette = palette_image.getpalette()
+    confetti = dict(confetti, color=nearest_palette_indices(confetti["color"], palette_image))
+
+    layers = []
+    for layer in (spin_layer, winner_layer):
+        layer_image = Image.fromarray(layer)
+        indexed = np.asarray(layer_image.quantize(palette=palette_image, dither=Image.Dither.NONE)).copy()
+        text_pixels = text_values = None
+        if text_mask:
+            layer_image.paste(TEXT_COLOR, text_box, text_mask)
+            with_text = np.asarray(layer_image.quantize(palette=palette_image, dither=Image.Dither.NONE))
+            text_pixels = np.zeros(indexed.shape, dtype=bool)
+            text_pixels[text_box[1]:text_box[3], text_box[0]:text_box[2]] = np.asarray(text_mask) > 0
+            text_values = with_text[text_pixels]
+        layers.append((indexed, text_pixels, text_values))
+
+    for frame_idx in range(extension_frames):
+        indexed, text_pixels, text_values = layers[1 if frame_idx > 0 else 0]
+        frame_array = indexed.copy()
+        step_confetti(confetti, width, height, gravity)
+        stamp_confetti(frame_array, confetti, dot_offsets)
+        if text_pixels is not None:
+            frame_array[text_pixels] = text_values
+        confetti_frame = Image.fromarray(frame_array, "P")
+        confetti_frame.putpalette(palette)
+        confetti_frame.info["duration"] = frame_duration
+        yield confetti_frame
+
+def visible_item_range(offset, num_items, item_spacing, center_x, frame_width, tile_width=100):
+    # Tile i sits at x = center_x - (i * item_spacing - offset), so only the
+    # indices whose tile overlaps [0, frame_width) need drawing. One tile of
+    # slack on both sides covers int() truncation and the highlight box.
+    first = math.floor((center_x + offset - frame_width) / item_spacing)
+    last = math.ceil((center_x + offset + tile_width) / item_spacing) + 1
+    return range(max(first, -2), min(last, num_items + 2))
+
+def first_spin_tiles(num_tiles, repeats, layout, initial_speed_modifier=1.0):
+    # Which of num_tiles repeated tiles the first spin frame shows. The spin
+    # starts a whole carousel ahead of where it stops, so this is the same
+    # for every seed.
+    num_items = num_tiles * repeats
+    item_spacing = layout["item_spacing"]
+    frame_width = layout["frame_size"][0]
+    offset = item_spacing * num_items * initial_speed_modifier
+    visible = visible_item_range(offset, num_items, item_spacing, frame_width // 2, frame_width, layout["tile_size"][0])
+    return sorted({i % num_items % num_tiles for i in visible})
+
+def spin_easing(progress):
+    if progress < 0.9:
+        return 2 ** (-10 * progress)
+    return 2 ** (-10 * 0.9) * (1 - (progress - 0.9) / 0.1)
+
+def schedule_spin_frames(offset_at, total_frames, frame_duration, min_displacement=1.0, blur_displacement=None, blur_hold=2):
+    """
+    Pick which uniform spin samples are worth rendering, by how far the carousel moves.
+
+    Samples that move the carousel less than min_displacement pixels from the
+    last kept frame add their time to that frame instead. While a single step
+    moves more than blur_displacement pixels the spin reads as a blur anyway,
+    so kept frames are held for up to blur_hold steps. The delays always add up
+    to total_frames * frame_duration, so the spin takes the same wall-clock time.
+
+    Returns a list of (progress, duration) pairs.
+    """
+    schedule = []
+    kept_offset = None
+    previous_offset = None
+    for frame_index in range(total_frames):
+        progress = frame_index / total_frames
+        offset = offset_at(progress)
+        if schedule:
+            step = abs(offset - previous_offset)
+            blurred = blur_displacement is not None and step > blur_displacement
+            if abs(offset - kept_offset) < min_displacement or (
+                blurred and schedule[-1][1] < frame_duration * blur_hold
+            ):
+                schedule[-1] = (schedule[-1][0], schedule[-1][1] + frame_duration)
+                previous_offset = offset
+                continue
+        schedule.append((progress, frame_duration))
+        kept_offset = offset
+        previous_offset = offset
+    return schedule
 
 def create_crate_unboxing_gif(
     images,
@@ -95,144 +439,392 @@ def create_crate_unboxing_gif(
     spin_duration=2,
     fps=17,
     initial_speed_modifier=1.0,
+    adaptive_schedule=True,
+    scale=1.0,
+    rng=None,
+):
+    frames = []
+    winner_position = None
+    for frame, winner_position in iter_spin_frames(
+        images,
+        rarity_colors,
+        target_index,
+        frame_size,
+        spin_duration,
+        fps,
+        initial_speed_modifier,
+        adaptive_schedule,
+        scale=scale,
+        rng=rng,
+    ):
+        frames.append(frame)
+    return frames, winner_position
+
+def iter_spin_frames(
+    images,
+    rarity_colors,
+    target_index,
+    frame_size=(400, 200),
+    spin_duration=2,
+    fps=17,
+    initial_speed_modifier=1.0,
+    adaptive_schedule=True,
+    palette_image=None,
+    scale=1.0,
+    rng=None,
 ):
+    # Yields (frame, winner_position) as each frame is drawn. images may hold
+    # pending downloads, each one is only waited for once its tile is visible.
+    # With palette_image the frames are drawn as "P" straight on that palette.
+    # frame_size is that of the standard layout, scale resizes everything.
+    layout = spin_layout(scale, frame_size)
     num_items = len(images)
+    winner_position = None
+    palette = indexed_palette(palette_image) if palette_image is not None else None
+    sprites = {}
+
+    def sprite_for(idx):
+        key = (id(images[idx]), rarity_colors[idx])
+        if key not in sprites:
+            sprite = make_item_sprite(resolve(images[idx]), rarity_colors[idx], layout["tile_size"], layout["bar_height"])
+            sprites[key] = make_indexed_sprite(sprite, palette_image) if palette else (sprite, sprite)
+        return sprites[key]
+
+    plan = plan_spin(
+        num_items, target_index, layout["frame_size"], spin_duration, fps, initial_speed_modifier, adaptive_schedule, layout["item_spacing"], rng
+    )
+    for offset, duration in plan:
+        frame, position = draw_spin_frame(offset, sprite_for, num_items, target_index, layout, palette=palette)
+        winner_position = position or winner_position
+        frame.info["duration"] = duration
+        yield frame, winner_position
+
+def plan_spin(
+    num_items,
+    target_index,
+    frame_size=(400, 200),
+    spin_duration=2,
+    fps=17,
+    initial_speed_modifier=1.0,
+    adaptive_schedule=True,
+    item_spacing=105,
+    rng=None,
+):
+    # Every spin frame up front, as (carousel offset, delay) pairs. This is the
+    # only random part of the spin, drawing a frame from its offset is pure.
     total_frames = int(spin_duration * fps)
-    item_spacing = 105
+    frame_duration = int(1000 / fps)
     carousel_width = item_spacing * num_items
-    center_x, center_y = frame_size[0] // 2, frame_size[1] // 2
-    highlight_color = (255, 215, 0)
-    frames = []
-    winner_position = None
 
-    random_offset = random.uniform(0,1)
+    random_offset = as_rng(rng).uniform(0,1)
     target_offset = (target_index * item_spacing) - (item_spacing * random_offset)
     adjusted_carousel_width = carousel_width * initial_speed_modifier
 
-    for frame_index in range(total_frames):
-        progress = frame_index / total_frames
-        if progress < 0.9:
-            easing = 2 ** (-10 * progress)
-        else:
-            easing = 2 ** (-10 * 0.9) * (1 - (progress - 0.9) / 0.1)
-
-        offset = easing * adjusted_carousel_width + (1 - easing) * target_offset
-
-        frame = Image.new("RGB", frame_size, (30, 30, 30))
-        draw = ImageDraw.Draw(frame)
-
-        for i in range(-2, num_items + 2):
-            idx = i % num_items
-            img_x = center_x - (i * item_spacing - offset)
-            img_y = center_y - 50
-
-            # Draw the highlight box if in the winning zone
-            if (center_x - item_spacing) < img_x and img_x < (center_x):
-                draw.rectangle(
-                    [img_x - 5, img_y - 5, img_x + 105, img_y + 105],
-                    outline=highlight_color,
-                    width=3,
-                )
-                # Store the winner position when it's in the highlight area
-                if idx == target_index:
-                    winner_position = (int(img_x), img_y)
-
-            # Paste the item image first
-            frame.paste(images[idx], (int(img_x), img_y))
-
-        # Create overlay for rarity bars with transparency
-        overlay = Image.new('RGBA', frame.size, (0, 0, 0, 0))
-        overlay_draw = ImageDraw.Draw(overlay)
-        
-        for i in range(-2, num_items + 2):
-            idx = i % num_items
-            img_x = center_x - (i * item_spacing - offset)
-            img_y = center_y - 50
-            
-            # Draw rarity color bar with fading effect on overlay
-            rarity_rgb = hex_to_rgb(rarity_colors[idx])
-            bar_height = 25
-            bar_y_top = img_y + 100 - bar_height  # Start 25 pixels above the bottom
-            
-            # Create gradient effect (transparent at top, solid at bottom)
-            for gradient_step in range(bar_height):
-                alpha = int((gradient_step / bar_height) * 255)  # 0 at top to 255 at bottom
-                color_with_alpha = rarity_rgb + (alpha,)
-                overlay_draw.rectangle(
-                    [int(img_x), bar_y_top + gradient_step, int(img_x) + 100, bar_y_top + gradient_step + 1],
-                    fill=color_with_alpha
-                )
-        
-        # Composite the overlay onto the frame
-        frame = frame.convert('RGBA')
-        frame = Image.alpha_composite(frame, overlay)
-        frame = frame.convert('RGB')
-
-        needle_x = center_x - 5
-        draw = ImageDraw.Draw(frame)
-        draw.polygon(
-            [(needle_x, 10), (needle_x + 10, 10), (needle_x + 5, 50)],
-            fill="red"
-        )
+    def offset_at(progress):
+        easing = spin_easing(progress)
+        return easing * adjusted_carousel_width + (1 - easing) * target_offset
 
-        frames.append(frame)
+    if adaptive_schedule:
+        schedule = schedule_spin_frames(offset_at, total_frames, frame_duration, blur_displacement=item_spacing)
+    else:
+        schedule = [(frame_index / total_frames, frame_duration) for frame_index in range(total_frames)]
 
-    for _ in range(fps):
-        frames.append(frames[-1])
+    plan = [(offset_at(progress), duration) for progress, duration in schedule]
+    # Hold the final position for a second as one long frame
+    plan[-1] = (plan[-1][0], plan[-1][1] + frame_duration * fps)
+    return plan
 
-    return frames, winner_position
+def draw_spin_frame(offset, sprite_for, num_items, target_index, layout=None, palette=None):
+    # Returns the frame and where the winner sits if it is in the highlight box.
+    # sprite_for returns (image, mask) pairs. With a palette from
+    # indexed_palette the frame is drawn as "P" using its colour indices.
+    layout = layout or spin_layout()
+    frame_size = layout["frame_size"]
+    item_spacing = layout["item_spacing"]
+    tile_width, tile_height = layout["tile_size"]
+    margin = layout["highlight_margin"]
+    center_x, center_y = frame_size[0] // 2, frame_size[1] // 2
+    winner_position = None
+
+    if palette is None:
+        colors = {"background": BACKGROUND_COLOR, "highlight": HIGHLIGHT_COLOR, "needle": NEEDLE_COLOR}
+        frame = Image.new("RGB", frame_size, BACKGROUND_COLOR)
+    else:
+        colors = palette
+        frame = Image.new("P", frame_size, palette["background"])
+        frame.putpalette(palette["colors"])
+    draw = ImageDraw.Draw(frame)
+    visible_items = visible_item_range(offset, num_items, item_spacing, center_x, frame_size[0], tile_width)
+
+    for i in visible_items:
+        idx = i % num_items
+        img_x = center_x - (i * item_spacing - offset)
+        img_y = center_y - tile_height // 2
+
+        # Draw the highlight box if in the winning zone
+        if (center_x - item_spacing) < img_x and img_x < (center_x):
+            draw.rectangle(
+                [img_x - margin, img_y - margin, img_x + tile_width + margin, img_y + tile_height + margin],
+                outline=colors["highlight"],
+                width=layout["highlight_width"],
+            )
+            # Store the winner position when it's in the highlight area
+            if idx == target_index:
+                winner_position = (int(img_x), img_y)
+
+        # Paste the item with its rarity bar already composited
+        sprite, mask = sprite_for(idx)
+        frame.paste(sprite, (int(img_x), img_y), mask)
+
+    needle_width = layout["needle_width"]
+    needle_x = center_x - needle_width // 2
+    draw.polygon(
+        [
+            (needle_x, layout["needle_top"]),
+            (needle_x + needle_width, layout["needle_top"]),
+            (needle_x + needle_width // 2, layout["needle_tip"]),
+        ],
+        fill=colors["needle"]
+    )
+    return frame, winner_position
 
 def fetch_image_from_url(url):
     try:
-        response = requests.get(url, timeout=10)
+        response = asset_fetcher.get(url)
         response.raise_for_status()
         return Image.open(io.BytesIO(response.content))
     except Exception as e:
-        print(f"Failed to fetch image from {url}: {e}")
+        logger.warning(f"Failed to fetch image from {url}: {e}")
         return None
 
-def preprocess_thumbnail_from_url(url, thumbnail_size=(100, 100), reduce_colors=True):
-    image = fetch_image_from_url(url)
-    if image is None:
-        return None
-    image = image.resize(thumbnail_size)
+def preprocess_thumbnail_from_url(url, thumbnail_size=(100, 100), reduce_colors=True, count=None):
+    # count(name) hears which cache tier served the tile, see ThumbnailCache
+    def prepare(image):
+        image = image.resize(thumbnail_size)
+        if reduce_colors:
+            image = image.convert("P", palette=Image.ADAPTIVE, colors=256)
+        return image
+    return thumbnail_cache.get_image(url, (thumbnail_size, reduce_colors), prepare, count)
+
+@functools.lru_cache(maxsize=8)
+def placeholder_tile(thumbnail_size=(100, 100), reduce_colors=True):
+    # Stands in for a thumbnail that failed or was too slow, so tiles stay
+    # lined up with their rarity colours
+    image = Image.new("RGB", thumbnail_size, (60, 60, 60))
+    ImageDraw.Draw(image).text((thumbnail_size[0] // 2, thumbnail_size[1] // 2), "?", fill=TEXT_COLOR, anchor="mm")
     if reduce_colors:
         image = image.convert("P", palette=Image.ADAPTIVE, colors=256)
     return image
 
-def preprocess_thumbnails_from_urls(urls, thumbnail_size=(100, 100), reduce_colors=True):
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        thumbnails = list(
-            executor.map(
-                preprocess_thumbnail_from_url,
-                urls,
-                [thumbnail_size] * len(urls),
-                [reduce_colors] * len(urls),
-            )
-        )
-    return [thumbnail for thumbnail in thumbnails if thumbnail is not None]
+def preprocess_thumbnails_from_urls(urls, thumbnail_size=(100, 100), reduce_colors=True, deadline=5):
+    return [pending.result() for pending in submit_thumbnails_from_urls(urls, thumbnail_size, reduce_colors, deadline)]
+
+def submit_thumbnails_from_urls(urls, thumbnail_size=(100, 100), reduce_colors=True, deadline=5, count=None):
+    # Starts every download and returns pending results, see preprocess_thumbnails_from_urls
+    def placeholder(url):
+        if count:
+            count("placeholder")
+        return placeholder_tile(thumbnail_size, reduce_colors)
+
+    # Tiles already in memory are handed out ready, the palette only takes
+    # the tiles that have arrived
+    return asset_fetcher.submit_with_deadline(
+        lambda url: preprocess_thumbnail_from_url(url, thumbnail_size, reduce_colors, count),
+        urls,
+        deadline,
+        placeholder,
+        ready=lambda url: thumbnail_cache.get_fresh(url, (thumbnail_size, reduce_colors), count),
+    )
+
+def render_winner_card(winning_item, scale=1.0, image_format="PNG"):
+    """
+    Static card of the winner, sent while the unboxing animation renders.
+
+    Looks like the last frame of the animation without the carousel: the
+    winner picture with its rarity bar in the highlight box, and the name
+    under it. Costs one download and one small encode. Returns a BytesIO in
+    image_format, "PNG" or "WEBP".
+    """
+    layout = spin_layout(scale)
+    width, height = layout["frame_size"]
+    tile_width, tile_height = layout["tile_size"]
+    margin = layout["highlight_margin"]
+
+    picture = fetch_image_from_url(winning_item['itemPictureURL']) or placeholder_tile(layout["tile_size"], False)
+    sprite = make_item_sprite(picture, winning_item['itemRarityColor'], layout["tile_size"], layout["bar_height"])
+
+    card = Image.new("RGB", layout["frame_size"], BACKGROUND_COLOR)
+    x, y = (width - tile_width) // 2, (height - tile_height) // 2
+    ImageDraw.Draw(card).rectangle(
+        [x - margin, y - margin, x + tile_width + margin, y + tile_height + margin],
+        outline=HIGHLIGHT_COLOR,
+        width=layout["highlight_width"],
+    )
+    card.paste(sprite, (x, y), sprite)
+    text_box, text_mask = render_text_mask(card.size, [
+        ((width // 2, layout["top_text_y"]), "WINNER!!!"),
+        ((width // 2, height - layout["bottom_text_y"]), winning_item['itemName']),
+    ], layout["font_size"])
+    if text_mask:
+        card.paste(TEXT_COLOR, text_box, text_mask)
+
+    card_bytes = io.BytesIO()
+    card.save(card_bytes, format=image_format, **({"lossless": True} if image_format == "WEBP" else {"optimize": True}))
+    card_bytes.seek(0)
+    return card_bytes
 
 def encode_frame_to_bytes(frame, duration):
     frame_bytes = io.BytesIO()
-    frame.save(frame_bytes, format="GIF", duration=duration)
+    frame.save(frame_bytes, format="GIF", duration=frame.info.get("duration", duration))
     return frame_bytes.getvalue()
 
 def assemble_gif_from_encoded_frames(encoded_frames, duration=50):
     gif_buffer = io.BytesIO()
     first_frame = Image.open(io.BytesIO(encoded_frames[0]))
     rest_frames = [Image.open(io.BytesIO(f)) for f in encoded_frames[1:]]
+    durations = [image.info.get("duration", duration) for image in [first_frame] + rest_frames]
     first_frame.save(
         gif_buffer,
         format="GIF",
         save_all=True,
         append_images=rest_frames,
-        duration=duration,
+        duration=durations,
         loop=0,
         optimize=False,
     )
     gif_buffer.seek(0)
     return gif_buffer
 
+def build_gif_palette(thumbnails, rarity_colors, confetti_base_color, colors=255):
+    """
+    Build one palette shared by every frame of a lottery GIF.
+
+    The palette gets at most colors entries. write_gif makes the index after
+    the last one transparent in delta frames, so keep colors one below a
+    power of two, like the default 255, and that index is the padding entry
+    of the GIF colour table, which no frame pixel uses.
+
+    The fixed UI colours and rarity colours get exact entries. The rest is
+    quantized from a mosaic of the item tiles (with their rarity bars) and a
+    grid of the colours generate_similar_color can produce for the confetti.
+    thumbnails may hold None for tiles that haven't arrived, those are left
+    out of the mosaic and get drawn with the nearest colours of the others.
+    """
+    fixed_colors = [BACKGROUND_COLOR, HIGHLIGHT_COLOR, NEEDLE_COLOR, TEXT_COLOR]
+    for rarity_color in rarity_colors:
+        rarity_rgb = hex_to_rgb(rarity_color)
+        if rarity_rgb not in fixed_colors:
+            fixed_colors.append(rarity_rgb)
+
+    arrived = [(thumbnail, color) for thumbnail, color in zip(thumbnails, rarity_colors) if thumbnail is not None]
+    sprites = list({id(sprite): sprite for sprite in build_item_sprites(*zip(*arrived))}.values()) if arrived else []
+    tile_width, tile_height = sprites[0].size if sprites else (101, 101)
+    confetti_grid = [
+        tuple(max(0, min(channel + variation, 255)) for channel, variation in zip(confetti_base_color, step))
+        for step in itertools.product(range(-150, 151, 50), repeat=3)
+    ]
+    mosaic_width = tile_width * 4
+    swatches_per_row = mosaic_width // 4
+    swatch_top = tile_height * math.ceil(len(sprites) / 4)
+    mosaic_height = swatch_top + 4 * math.ceil(len(confetti_grid) / swatches_per_row)
+    mosaic = Image.new("RGB", (mosaic_width, mosaic_height), BACKGROUND_COLOR)
+    for i, sprite in enumerate(sprites):
+        mosaic.paste(sprite, ((i % 4) * tile_width, (i // 4) * tile_height), sprite)
+    for i, color in enumerate(confetti_grid):
+        x = (i % swatches_per_row) * 4
+        y = swatch_top + (i // swatches_per_row) * 4
+        mosaic.paste(color, (x, y, x + 4, y + 4))
+
+    quantized = mosaic.quantize(colors=max(colors - len(fixed_colors), 1), method=Image.Quantize.MEDIANCUT, kmeans=2)
+    palette = [channel for color in fixed_colors for channel in color] + quantized.getpalette()
+    palette_image = Image.new("P", (1, 1))
+    palette_image.putpalette(palette[:colors * 3])
+    return palette_image
+
+def write_gif(fp, frames, palette_image, duration=50, loop=0, delta=True):
+    # Every frame is mapped onto the shared palette once and written straight
+    # out, so there is no per-frame colour table and no intermediate decode.
+    # Frames carry their delay in info["duration"], duration is the fallback.
+    # With delta on, frames after the first only store the bounding box that
+    # changed, with untouched pixels left transparent over the previous frame.
+    # The transparent index is the first one past the palette, which has to
+    # lie inside the colour table, so a full 256-colour palette gets no deltas.
+    transparent_index = len(palette_image.getpalette()) // 3
+    delta = delta and transparent_index < 256
+    previous = None
+    pending = None
+    for frame in frames:
+        frame_duration = frame.info.get("duration", duration)
+        if frame.mode == "P":
+            # Already drawn on the shared palette
+            indexed = frame
+        else:
+            indexed = frame.quantize(palette=palette_image, dither=Image.Dither.NONE)
+        current = np.asarray(indexed)
+        if previous is None:
+            header, _ = GifImagePlugin.getheader(indexed, info={"loop": loop, "duration": duration})
+            for block in header:
+                fp.write(block)
+            pending = {"image": indexed, "offset": (0, 0), "duration": frame_duration}
+        elif delta:
+            changed = current != previous
+            if not changed.any():
+                # Identical frames become a longer delay on the previous one
+                pending["duration"] += frame_duration
+                continue
+            rows = np.flatnonzero(changed.any(axis=1))
+            columns = np.flatnonzero(changed.any(axis=0))
+            top, bottom = rows[0], rows[-1] + 1
+            left, right = columns[0], columns[-1] + 1
+            patch = current[top:bottom, left:right].copy()
+            patch[~changed[top:bottom, left:right]] = transparent_index
+            write_gif_frame(fp, pending)
+            pending = {
+                "image": Image.fromarray(patch, "L"),
+                "offset": (int(left), int(top)),
+                "duration": frame_duration,
+                "transparency": transparent_index,
+            }
+        else:
+            write_gif_frame(fp, pending)
+            pending = {"image": indexed, "offset": (0, 0), "duration": frame_duration}
+        previous = current
+    if pending is not None:
+        write_gif_frame(fp, pending)
+    fp.write(b";")
+
+def write_gif_frame(fp, frame):
+    params = {"duration": frame["duration"], "disposal": 1}
+    if "transparency" in frame:
+        params["transparency"] = frame["transparency"]
+    for block in GifImagePlugin.getdata(frame["image"], frame["offset"], **params):
+        fp.write(block)
+
+def save_gif(frames, palette_image, duration=50, delta=True):
+    gif_buffer = io.BytesIO()
+    write_gif(gif_buffer, frames, palette_image, duration, delta=delta)
+    gif_buffer.seek(0)
+    return gif_buffer
+
+def save_animation(frames, palette_image, output_format="gif", duration=50):
+    # Encodes frames in one of OUTPUT_FORMATS and returns the BytesIO
+    if output_format == "gif":
+        return save_gif(frames, palette_image, duration)
+    settings = OUTPUT_FORMATS[output_format]
+    frames = list(frames)
+    buffer = io.BytesIO()
+    frames[0].save(
+        buffer,
+        format=settings["format"],
+        save_all=True,
+        append_images=frames[1:],
+        duration=[frame.info.get("duration", duration) for frame in frames],
+        loop=0,
+        **settings["params"],
+    )
+    buffer.seek(0)
+    return buffer
+
 def parallel_save_gif(frames, duration=50):
     with concurrent.futures.ThreadPoolExecutor() as executor:
         encoded_frames = list(
@@ -240,7 +832,139 @@ def parallel_save_gif(frames, duration=50):
         )
     return assemble_gif_from_encoded_frames(encoded_frames, duration)
 
-def generate_gif(items, winning_item, fps=20):
+def iter_lottery_frames(images, rarity_colors, target_index, winner_image, rarity, rarity_color, top_text, bottom_text, fps=20, spin_duration=5, palette_image=None, scale=1.0, rng=None):
+    # The spin followed by the confetti, drawn in this process
+    rng = as_rng(rng)
+    frame_duration = int(1000 / fps)
+    last_frame = None
+    winner_position = None
+    for last_frame, winner_position in iter_spin_frames(
+        images, rarity_colors, target_index, spin_duration=spin_duration, fps=fps, palette_image=palette_image, scale=scale, rng=rng
+    ):
+        yield last_frame
+    yield from iter_confetti_frames(
+        last_frame, 5 * fps, top_text, bottom_text, rarity, rarity_color,
+        winner_image, winner_position, frame_duration, palette_image, scale, rng
+    )
+
+def compare_palette_rendering(images, rarity_colors, target_index, winner_image, rarity, rarity_color, palette_image, fps=20, spin_duration=5, seed=0):
+    """
+    Check the palette-native frames against the RGB path they replace.
+
+    Both paths are drawn from the same seed. The RGB frames are mapped
+    onto palette_image the way write_gif does it, so this compares what ends up
+    in the GIF. Returns the fraction of pixels that differ and the worst frame
+    PSNR in dB (inf when every frame is identical).
+    """
+    texts = ("WINNER!!!", "Check")
+    rgb_frames = iter_lottery_frames(
+        images, rarity_colors, target_index, winner_image, rarity, rarity_color, *texts, fps, spin_duration, rng=seed
+    )
+    rgb_frames = [frame.quantize(palette=palette_image, dither=Image.Dither.NONE).convert("RGB") for frame in rgb_frames]
+    indexed_frames = list(iter_lottery_frames(
+        images, rarity_colors, target_index, winner_image, rarity, rarity_color, *texts, fps, spin_duration, palette_image, rng=seed
+    ))
+
+    changed_pixels = 0
+    total_pixels = 0
+    worst_psnr = math.inf
+    for rgb_frame, indexed_frame in zip(rgb_frames, indexed_frames, strict=True):
+        expected = np.asarray(rgb_frame, dtype=np.float64)
+        actual = np.asarray(indexed_frame.convert("RGB"), dtype=np.float64)
+        changed_pixels += int(np.any(expected != actual, axis=2).sum())
+        total_pixels += expected.shape[0] * expected.shape[1]
+        mse = np.mean((expected - actual) ** 2)
+        if mse:
+            worst_psnr = min(worst_psnr, 10 * math.log10(255 ** 2 / mse))
+    return changed_pixels / total_pixels, worst_psnr
+
+# Cheapest degradations first, each one applies on top of those before it.
+# Colour counts stay one below a power of two, see build_gif_palette.
+DEGRADATIONS = [
+    ("3s confetti", {"confetti_seconds": 3}),
+    ("15 fps", {"fps": 15}),
+    ("127 colours", {"colors": 127}),
+    ("2s confetti", {"confetti_seconds": 2}),
+    ("10 fps", {"fps": 10}),
+    ("63 colours", {"colors": 63}),
+    ("75% resolution", {"scale": 0.75}),
+    ("50% resolution", {"scale": 0.5}),
+]
+
+# Seconds and bytes per output frame pixel, learned from previous draws and
+# kept apart per (output format, layout tier), which cost very differently
+render_costs = {}
+
+def degraded_settings(fps, level, scale=1.0):
+    # scale is that of the layout tier, the degradations shrink it further
+    settings = {"fps": fps, "confetti_seconds": 5, "colors": 255, "scale": 1.0}
+    for _, change in DEGRADATIONS[:level]:
+        settings.update(change)
+    settings["fps"] = min(settings["fps"], fps)
+    settings["scale"] *= scale
+    return settings
+
+def frame_pixels(settings, frame_size=(400, 200)):
+    frames = (SPIN_DURATION + settings["confetti_seconds"]) * settings["fps"]
+    return frames * frame_size[0] * frame_size[1] * settings["scale"] ** 2
+
+def applied_degradations(fps, level):
+    # Names of the degradations up to level that are in effect. Left out are
+    # those a later one overrides, like "75% resolution" under "50% resolution",
+    # and those that change nothing, like "15 fps" for a 10 fps draw.
+    base = degraded_settings(fps, 0)
+    settings = degraded_settings(fps, level)
+    setters = {}
+    for name, change in DEGRADATIONS[:level]:
+        for key in change:
+            setters[key] = name
+    in_effect = {name for key, name in setters.items() if settings[key] != base[key]}
+    return [name for name, _ in DEGRADATIONS[:level] if name in in_effect]
+
+def estimate_render_cost(settings, cost_key=("gif", "standard")):
+    # (seconds, bytes) expected for settings, 0 while nothing has been learned
+    # for cost_key, an (output format, tier) pair
+    pixels = frame_pixels(settings)
+    costs = render_costs.get(cost_key, {})
+    return tuple(costs.get(key, 0) * pixels for key in ("seconds", "bytes"))
+
+def learn_render_costs(settings, seconds, size, cost_key=("gif", "standard")):
+    # Moving average, so a single slow or unusual draw doesn't swing it
+    pixels = frame_pixels(settings)
+    costs = render_costs.setdefault(cost_key, {})
+    for key, value in (("seconds", seconds / pixels), ("bytes", size / pixels)):
+        previous = costs.get(key)
+        costs[key] = value if previous is None else (previous + value) / 2
+
+def choose_render_level(fps, byte_budget, time_budget, first_level=0, scale=1.0, cost_key=("gif", "standard")):
+    # The first level at or after first_level expected to fit both budgets
+    for level in range(first_level, len(DEGRADATIONS)):
+        seconds, size = estimate_render_cost(degraded_settings(fps, level, scale), cost_key)
+        if seconds <= time_budget and size <= byte_budget:
+            return level
+    return len(DEGRADATIONS)
+
+def winner_rarity(items, winning_item):
+    # Calculate normalized rarity (inverse of weight proportion)
+    # Higher weight = more common = lower rarity value for confetti
+    total_weight = sum(item.get('itemRarity', 1) for item in items) + winning_item['itemRarity']
+    normalized_rarity = 1.0 - (winning_item['itemRarity'] / total_weight)
+    # Scale to 0-10 range for confetti density
+    return normalized_rarity * 10
+
+def generate_gif(
+    items,
+    winning_item,
+    fps=20,
+    palette_native=True,
+    output_format=OUTPUT_FORMAT,
+    byte_budget=BYTE_BUDGET,
+    time_budget=TIME_BUDGET,
+    report=None,
+    tier="standard",
+    rng=None,
+    profile=None,
+):
     """
     Generate a crate unboxing GIF with confetti animation.
     
@@ -249,80 +973,171 @@ def generate_gif(items, winning_item, fps=20):
         winning_item: Dict with keys: itemThumbnailURL, itemPictureURL, 
                       itemRarity (weight), itemRarityColor, itemName
         fps: Frames per second for the GIF
+        palette_native: Draw frames straight onto the shared palette instead of
+                        drawing RGB and quantizing every frame while encoding
+        output_format: One of OUTPUT_FORMATS, e.g. "gif", "webp" or "apng"
+        tier: One of LAYOUT_TIERS, the size the animation is drawn at
+        rng: Seed or random.Random for the winner's place, the spin and the
+             confetti, so the same seed draws the same animation
+        byte_budget: Largest output wanted, in bytes
+        time_budget: Seconds the whole call should take
+        report: Optional dict, filled with the degradations applied to fit
+                the budgets, the settings used, output bytes and seconds
+        profile: Optional RenderProfile, filled with per-stage timings, frame
+                 counts, bytes and thumbnail cache counts. The stages overlap,
+                 so encode's wall time includes waiting for frames.
     
     Returns:
-        BytesIO object containing the GIF
+        BytesIO object containing the animation in output_format
     """
-    start_time = time.time()
-    
-    # Calculate normalized rarity (inverse of weight proportion)
-    # Higher weight = more common = lower rarity value for confetti
-    total_weight = sum(item.get('itemRarity', 1) for item in items) + winning_item['itemRarity']
-    normalized_rarity = 1.0 - (winning_item['itemRarity'] / total_weight)
-    # Scale to 0-10 range for confetti density
-    computed_rarity = normalized_rarity * 10
-    print(winning_item['itemRarity'])
-    print(computed_rarity)
-    # Extract thumbnail URLs and rarity colors from items
-    thumbnail_urls = [item['itemThumbnailURL'] for item in items]
-    rarity_colors = [item['itemRarityColor'] for item in items]
-    
-    # Randomize winning item placement
-    target_index = random.randint(0, len(items) - 1)
-    
-    # Insert winning item at target position
-    items_copy = items.copy()
-    items_copy[target_index] = {
-        'itemThumbnailURL': winning_item['itemThumbnailURL'],
-        'itemRarityColor': winning_item['itemRarityColor']
-    }
-    thumbnail_urls = [item['itemThumbnailURL'] for item in items_copy]
-    rarity_colors = [item['itemRarityColor'] for item in items_copy]
+    profile = profile or RenderProfile()
+    with profile.call():
+        start_time = time.time()
+        report = {} if report is None else report
     
-    # Preprocess thumbnails
-    preprocessed_thumbnails = preprocess_thumbnails_from_urls(
-        thumbnail_urls, 
-        thumbnail_size=(100, 100), 
-        reduce_colors=True
-    )
-    print("--- %s seconds to preprocess thumbnails ---" % (time.time() - start_time))
-    
-    # Create spinning animation
-    start_time = time.time()
-    frames, winner_position = create_crate_unboxing_gif(
-        preprocessed_thumbnails * 16,
-        rarity_colors * 16,
-        target_index, 
-        spin_duration=5, 
-        fps=fps
-    )
-    print("--- %s seconds to create frames ---" % (time.time() - start_time))
+        computed_rarity = winner_rarity(items, winning_item)
+        logger.debug(f"Winner weight {winning_item['itemRarity']}, computed rarity {computed_rarity}")
+        # Extract thumbnail URLs and rarity colors from items
+        thumbnail_urls = [item['itemThumbnailURL'] for item in items]
+        rarity_colors = [item['itemRarityColor'] for item in items]
     
-    # Add confetti and text
-    top_text = "WINNER!!!"
-    bottom_text = winning_item['itemName']
-    extension_frames = 5 * fps
+        # Randomize winning item placement
+        rng = as_rng(rng)
+        target_index = rng.randint(0, len(items) - 1)
     
-    start_time = time.time()
-    frames = extend_gif_with_confetti_and_text(
-        frames, 
-        extension_frames, 
-        top_text, 
-        bottom_text, 
-        computed_rarity,  # Use computed rarity instead of raw weight
-        winning_item['itemRarityColor'],
-        winning_item['itemPictureURL'],
-        winner_position
-    )
-    print("--- %s seconds to add confetti ---" % (time.time() - start_time))
-    print(f"Total frames: {len(frames)}")
+        # Insert winning item at target position
+        items_copy = items.copy()
+        items_copy[target_index] = {
+            'itemThumbnailURL': winning_item['itemThumbnailURL'],
+            'itemRarityColor': winning_item['itemRarityColor']
+        }
+        thumbnail_urls = [item['itemThumbnailURL'] for item in items_copy]
+        rarity_colors = [item['itemRarityColor'] for item in items_copy]
     
-    # Save GIF
-    start_time = time.time()
-    gif_bytes = parallel_save_gif(frames, duration=int(1000 / fps))
-    print("--- %s seconds to save GIF ---" % (time.time() - start_time))
+        top_text = "WINNER!!!"
+        bottom_text = winning_item['itemName']
+        tier_scale = LAYOUT_TIERS[tier]
+
+        # The stages overlap: downloads start right away, the spin is drawn as
+        # soon as its visible tiles arrive, the winner picture downloads while the
+        # spin renders, and the encoder takes frames as they come off the renderer.
+        winner_image = asset_fetcher.submit(fetch_image_from_url, winning_item['itemPictureURL'])
+        pending_thumbnails = submit_thumbnails_from_urls(
+            thumbnail_urls, 
+            thumbnail_size=spin_layout(tier_scale)["tile_size"], 
+            reduce_colors=True,
+            count=profile.count
+        )
+        palettes = {}
+
+        def build_palette(colors):
+            # Frames can't be drawn on the palette before it exists, so it only
+            # waits for the tiles the first spin frame shows, the same ones the
+            # spin would wait for. Tiles still downloading are left out.
+            first_tiles = first_spin_tiles(len(pending_thumbnails), CAROUSEL_REPEATS, spin_layout(tier_scale))
+            with profile.stage("thumbnails"):
+                thumbnails = [
+                    pending.result() if i in first_tiles or pending.done() else None
+                    for i, pending in enumerate(pending_thumbnails)
+                ]
+            if None in thumbnails:
+                profile.count("palette_tiles_missing", thumbnails.count(None))
+            with profile.stage("palette"):
+                return build_gif_palette(thumbnails, rarity_colors, hex_to_rgb(winning_item['itemRarityColor']), colors)
+
+        def palette_for(colors):
+            if colors not in palettes:
+                palettes[colors] = palette_executor.submit(build_palette, colors)
+            return palettes[colors]
+
+        def render_frames(settings, palette_image):
+            last_frame = None
+            winner_position = None
+            fps = settings["fps"]
+            frame_duration = int(1000 / fps)
+            # The palette is in as soon as the first frame's tiles are
+            frame_palette = resolve(palette_image) if palette_native else None
+            spin_frames = iter_spin_frames(
+                pending_thumbnails * CAROUSEL_REPEATS,
+                rarity_colors * CAROUSEL_REPEATS,
+                target_index, 
+                spin_duration=SPIN_DURATION, 
+                fps=fps,
+                palette_image=frame_palette,
+                scale=settings["scale"],
+                rng=rng
+            )
+            with profile.stage("spin"):
+                for last_frame, winner_position in spin_frames:
+                    profile.add("spin", frames=1)
+                    yield last_frame
+
+            # Add confetti and text
+            confetti_frames = iter_confetti_frames(
+                last_frame, 
+                settings["confetti_seconds"] * fps, 
+                top_text, 
+                bottom_text, 
+                computed_rarity,  # Use computed rarity instead of raw weight
+                winning_item['itemRarityColor'],
+                winner_image,
+                winner_position,
+                frame_duration,
+                frame_palette,
+                settings["scale"],
+                rng
+            )
+            with profile.stage("confetti"):
+                for frame in confetti_frames:
+                    profile.add("confetti", frames=1)
+                    yield frame
+
+        def render(settings):
+            palette_image = palette_for(settings["colors"])
+            frames = iterate_in_background(render_frames(settings, palette_image))
+
+            # Encoding starts once the palette is in
+            palette_image = resolve(palette_image)
+            with profile.stage("encode"):
+                gif_bytes = save_animation(frames, palette_image, output_format, duration=int(1000 / settings["fps"]))
+            profile.add("encode", bytes=len(gif_bytes.getbuffer()))
+            return gif_bytes
+
+        # Start from the richest settings expected to fit both budgets. Only the
+        # byte budget can be checked afterwards, so an animation that turns out
+        # too big is drawn again smaller while the time budget allows it.
+        deadline = start_time + time_budget
+        cost_key = (output_format, tier)
+        level = choose_render_level(fps, byte_budget, time_budget, scale=tier_scale, cost_key=cost_key)
+        attempts = 0
+        while True:
+            settings = degraded_settings(fps, level, tier_scale)
+            attempt_start = time.time()
+            gif_bytes = render(settings)
+            attempts += 1
+            profile.count("attempts")
+            size = len(gif_bytes.getbuffer())
+            learn_render_costs(settings, time.time() - attempt_start, size, cost_key)
+            if size <= byte_budget or level == len(DEGRADATIONS):
+                break
+            next_level = choose_render_level(fps, byte_budget, deadline - time.time(), level + 1, tier_scale, cost_key)
+            if estimate_render_cost(degraded_settings(fps, next_level, tier_scale), cost_key)[0] > deadline - time.time():
+                logger.warning(f"No time left to get under {byte_budget} bytes")
+                break
+            level = next_level
+
+        report.update({
+            "degradations": applied_degradations(fps, level),
+            "settings": settings,
+            "attempts": attempts,
+            "bytes": size,
+            "seconds": time.time() - start_time,
+            "within_budget": size <= byte_budget and time.time() <= deadline,
+        })
+        if report["degradations"]:
+            logger.debug(f"Degraded to fit the budget: {', '.join(report['degradations'])}")
     
-    return gif_bytes
+        return gif_bytes
 
 # Example usage:
 # items = [
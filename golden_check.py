@@ -0,0 +1,239 @@
+"""
+Golden-image regression check for gif.py.
+
+Renders a few fixed lottery scenarios with fixed seeds, from the images in
+golden/fixtures served over a local HTTP server, and compares every frame
+and delay with the animations stored in golden/, GIF or APNG. Run it before and after a
+change to the renderer:
+
+    python golden_check.py                 # compare, exits 1 on a mismatch
+    python golden_check.py --tolerance 8   # allow small per-pixel differences
+    python golden_check.py --update        # store the current output as golden
+
+It also checks that frames drawn straight onto the palette look like RGB
+frames mapped onto it, within --max-changed and --min-psnr, and that every
+transparent index in a GIF lies inside its colour table.
+
+The goldens depend on Pillow's text rendering and quantizer, so they may need
+a tolerance, or an update, after a Pillow upgrade.
+"""
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image, ImageSequence
+import argparse
+import functools
+import io
+import os
+import sys
+import tempfile
+import threading
+import numpy as np
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+FIXTURE_DIR = os.path.join(GOLDEN_DIR, "fixtures")
+
+# The thumbnail cache must not hand out tiles from an earlier run
+thumbnail_dir = tempfile.TemporaryDirectory(prefix="golden-thumbnails-")
+os.environ["THUMBNAIL_CACHE_DIR"] = thumbnail_dir.name
+
+from gif import (
+    CAROUSEL_REPEATS, LAYOUT_TIERS, OUTPUT_FORMATS, build_gif_palette, compare_palette_rendering, fetch_image_from_url,
+    generate_gif, hex_to_rgb, preprocess_thumbnails_from_urls, render_costs, spin_layout,
+)
+
+RARITY_COLORS = ["#b0c3d9", "#5e98d9", "#4b69ff", "#8847ff", "#d32ce6", "#e4ae39"]
+RARITY_WEIGHTS = [100, 80, 50, 25, 10, 2]
+
+SCENARIOS = [
+    {"name": "preview_common", "winner": 0, "seed": 1, "fps": 10, "tier": "preview"},
+    {"name": "preview_rare", "winner": 5, "seed": 2, "fps": 10, "tier": "preview"},
+    {"name": "standard_rgb", "winner": 3, "seed": 3, "fps": 5, "tier": "standard", "palette_native": False},
+    {"name": "preview_apng", "winner": 4, "seed": 4, "fps": 5, "tier": "preview", "output_format": "apng"},
+    # A budget nothing fits, so every degradation applies, down to 63 colours
+    {"name": "standard_all_degradations", "winner": 2, "seed": 5, "fps": 10, "tier": "standard", "byte_budget": 1},
+]
+
+# Winners and seeds for the palette check, the common and the rarest item
+PALETTE_CASES = [{"winner": 0, "seed": 1}, {"winner": 5, "seed": 2}]
+# The fixtures change up to 0.15% of pixels with a worst frame of 37.9 dB,
+# mostly the highlight spill and antialiased text edges
+MAX_CHANGED_FRACTION = 0.01
+MIN_PSNR = 30.0
+
+def serve_fixtures():
+    handler = functools.partial(QuietHandler, directory=FIXTURE_DIR)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+def render_scenario(scenario, base_url):
+    items = [
+        {
+            'itemThumbnailURL': f"{base_url}item{i}.png",
+            'itemRarityColor': color,
+            'itemRarity': weight,
+        }
+        for i, (color, weight) in enumerate(zip(RARITY_COLORS, RARITY_WEIGHTS))
+    ]
+    # The palette only takes the tiles that arrived before the spin starts,
+    # so tiles are loaded up front to render the same palette every time
+    preprocess_thumbnails_from_urls(
+        [item['itemThumbnailURL'] for item in items], spin_layout(LAYOUT_TIERS[scenario["tier"]])["tile_size"]
+    )
+    # Costs learned from earlier scenarios would change which levels a budget
+    # tries, and with them the seeded draws
+    render_costs.clear()
+    winner = scenario["winner"]
+    winning_item = dict(
+        items[winner],
+        itemPictureURL=items[winner]['itemThumbnailURL'],
+        itemName=f"Fixture item {winner}",
+    )
+    return generate_gif(
+        items,
+        winning_item,
+        fps=scenario["fps"],
+        palette_native=scenario.get("palette_native", True),
+        output_format=scenario.get("output_format", "gif"),
+        byte_budget=scenario.get("byte_budget", float("inf")),
+        time_budget=float("inf"),
+        tier=scenario["tier"],
+        rng=scenario["seed"],
+    ).getvalue()
+
+def check_palette_rendering(base_url, max_changed, min_psnr):
+    # Returns a list of problems, empty when every case is within the limits
+    urls = [f"{base_url}item{i}.png" for i in range(len(RARITY_COLORS))]
+    thumbnails = preprocess_thumbnails_from_urls(urls, spin_layout()["tile_size"])
+    problems = []
+    for case in PALETTE_CASES:
+        winner = case["winner"]
+        palette_image = build_gif_palette(thumbnails, RARITY_COLORS, hex_to_rgb(RARITY_COLORS[winner]))
+        rarity = (1.0 - RARITY_WEIGHTS[winner] / (sum(RARITY_WEIGHTS) + RARITY_WEIGHTS[winner])) * 10
+        changed, worst_psnr = compare_palette_rendering(
+            thumbnails * CAROUSEL_REPEATS, RARITY_COLORS * CAROUSEL_REPEATS, winner, fetch_image_from_url(urls[winner]),
+            rarity, RARITY_COLORS[winner], palette_image, fps=10, seed=case["seed"],
+        )
+        print(f"palette_rendering winner {winner}: {changed:.2%} of pixels changed, worst frame {worst_psnr:.1f} dB")
+        if changed > max_changed:
+            problems.append(f"winner {winner}: {changed:.2%} of pixels changed, at most {max_changed:.2%} allowed")
+        if worst_psnr < min_psnr:
+            problems.append(f"winner {winner}: worst frame {worst_psnr:.1f} dB, at least {min_psnr:.1f} dB required")
+    return problems
+
+def skip_sub_blocks(data, position):
+    # Position after the data sub-blocks starting at position
+    while data[position]:
+        position += data[position] + 1
+    return position + 1
+
+def gif_table_problems(data):
+    # Transparent indices outside the global colour table. Pillow decodes
+    # those anyway, other decoders don't have to.
+    flags = data[10]
+    table_size = 2 << (flags & 7) if flags & 0x80 else 0
+    position = 13 + 3 * table_size
+    problems = []
+    frame = 0
+    while position < len(data) and data[position] != 0x3B:
+        if data[position] == 0x21:
+            label = data[position + 1]
+            position += 2
+            # Graphic control extension: size, flags, delay, transparent index
+            if label == 0xF9 and data[position + 1] & 1 and data[position + 4] >= table_size:
+                problems.append(f"frame {frame}: transparent index {data[position + 4]} outside the {table_size} colour table")
+            position = skip_sub_blocks(data, position)
+        elif data[position] == 0x2C:
+            flags = data[position + 9]
+            position += 10
+            if flags & 0x80:
+                position += 3 * (2 << (flags & 7))
+            # Past the LZW code size
+            position = skip_sub_blocks(data, position + 1)
+            frame += 1
+        else:
+            problems.append(f"unknown block {data[position]:#x} at byte {position}")
+            break
+    return problems
+
+def decode_frames(fp):
+    # Fully composited RGB frames with their delays
+    image = Image.open(fp)
+    return [(np.asarray(frame.convert("RGB"), dtype=np.int16), frame.info.get("duration")) for frame in ImageSequence.Iterator(image)]
+
+def compare_frames(expected, actual, tolerance):
+    # Returns a list of problems, empty when actual matches expected
+    if len(expected) != len(actual):
+        return [f"{len(actual)} frames, expected {len(expected)}"]
+    problems = []
+    for index, ((expected_pixels, expected_duration), (actual_pixels, actual_duration)) in enumerate(zip(expected, actual)):
+        if expected_duration != actual_duration:
+            problems.append(f"frame {index}: delay {actual_duration}ms, expected {expected_duration}ms")
+        if expected_pixels.shape != actual_pixels.shape:
+            problems.append(f"frame {index}: size {actual_pixels.shape[1::-1]}, expected {expected_pixels.shape[1::-1]}")
+            continue
+        difference = np.abs(expected_pixels - actual_pixels).max(axis=2)
+        over = int((difference > tolerance).sum())
+        if over:
+            problems.append(f"frame {index}: {over} pixels off by up to {int(difference.max())}")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--update", action="store_true", help="store the current output as the goldens")
+    parser.add_argument("--tolerance", type=int, default=0, help="largest allowed difference of any colour channel")
+    parser.add_argument("--max-changed", type=float, default=MAX_CHANGED_FRACTION, help="largest fraction of pixels the palette path may change")
+    parser.add_argument("--min-psnr", type=float, default=MIN_PSNR, help="lowest PSNR in dB any palette-drawn frame may have")
+    parser.add_argument("scenarios", nargs="*", help="names of the scenarios to run, all by default, palette_rendering for the palette check")
+    args = parser.parse_args()
+
+    server, base_url = serve_fixtures()
+    failed = False
+    try:
+        for scenario in SCENARIOS:
+            if args.scenarios and scenario["name"] not in args.scenarios:
+                continue
+            extension = OUTPUT_FORMATS[scenario.get("output_format", "gif")]["extension"]
+            golden_path = os.path.join(GOLDEN_DIR, f"{scenario['name']}.{extension}")
+            rendered = render_scenario(scenario, base_url)
+            if args.update:
+                with open(golden_path, "wb") as f:
+                    f.write(rendered)
+                print(f"{scenario['name']}: stored {len(rendered)} bytes")
+                continue
+            if not os.path.exists(golden_path):
+                print(f"{scenario['name']}: no golden, run with --update")
+                failed = True
+                continue
+
+            problems = compare_frames(decode_frames(golden_path), decode_frames(io.BytesIO(rendered)), args.tolerance)
+            if extension == "gif":
+                problems += gif_table_problems(rendered)
+            if problems:
+                failed = True
+                print(f"{scenario['name']}: FAILED")
+                for problem in problems[:10]:
+                    print(f"  {problem}")
+                if len(problems) > 10:
+                    print(f"  ... and {len(problems) - 10} more")
+            else:
+                print(f"{scenario['name']}: ok")
+
+        if not args.update and (not args.scenarios or "palette_rendering" in args.scenarios):
+            problems = check_palette_rendering(base_url, args.max_changed, args.min_psnr)
+            if problems:
+                failed = True
+                print("palette_rendering: FAILED")
+                for problem in problems:
+                    print(f"  {problem}")
+            else:
+                print("palette_rendering: ok")
+    finally:
+        server.shutdown()
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,26 @@
+from PIL import Image, ImageChops
+import io
+
+def count_pixel_changes(img1, img2):
+    img1 = img1.convert('RGBA')
+    img2 = img2.convert('RGBA')
+    img1_height, img1_width = img1.size
+    img2_height, img2_width = img2.size
+
+    if(img1_height != img2_height or img1_width != img2_width):
+        return None
+
+    diff = ImageChops.difference(img1, img2)
+
+    diff_pixels = sum(pixel != (0, 0, 0, 0) for pixel in diff.getdata())
+
+    return diff_pixels
+
+def count_pixel_changes_in_files(image_bytes, reference_bytes):
+    # Encoded images in and a number out, so it can run in another process
+    return count_pixel_changes(Image.open(io.BytesIO(image_bytes)), Image.open(io.BytesIO(reference_bytes)))
+
+def convert_to_png(image_bytes):
+    png_image_io = io.BytesIO()
+    Image.open(io.BytesIO(image_bytes)).save(png_image_io, format="PNG")
+    return png_image_io.getvalue()
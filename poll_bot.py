@@ -1,11 +1,11 @@
+import asyncio
 import math
 import traceback
 import discord
 from discord import app_commands
 from discord.ext import commands
-import requests
 import PIL
-from PIL import Image, ImageChops
+from PIL import Image
 import logging
 import io
 import os
@@ -24,7 +24,11 @@ import pkg_resources
 import filetype
 import urllib.parse
 
-from gif import generate_gif
+from gif import render_winner_card, winner_rarity, OUTPUT_FORMAT, OUTPUT_FORMATS
+from prerender_pool import PrerenderPool
+from render_queue import RenderQueue
+from render_worker import RenderBusy, RenderWorkerClient
+from api_client import ApiClient
 
 logging.basicConfig(
     level=logging.INFO,
@@ -46,6 +50,22 @@ CURRENT_PLACEID = os.getenv('CURRENT_PLACEID')
 CURRENT_TOPICID = os.getenv('CURRENT_TOPICID')
 MEDIA_HOST = os.getenv('MEDIA_HOST')
 CURRENT_LOTTERY = os.getenv('CURRENT_LOTTERY')
+PRERENDER_PER_ITEM = int(os.getenv('PRERENDER_PER_ITEM', '2'))
+PRERENDER_MAX_BYTES = int(os.getenv('PRERENDER_MAX_BYTES', str(64 * 1024 * 1024)))
+# Lottery renders running at once, and draws allowed to wait for one
+RENDER_CONCURRENCY = int(os.getenv('RENDER_CONCURRENCY', '2'))
+RENDER_QUEUE_SIZE = int(os.getenv('RENDER_QUEUE_SIZE', '8'))
+# Render worker service, renders run in this process when unset, or when no worker answers
+RENDER_WORKER_URL = os.getenv('RENDER_WORKER_URL') or None
+# Replicas behind RENDER_WORKER_URL, each with RENDER_CONCURRENCY slots
+RENDER_WORKER_REPLICAS = int(os.getenv('RENDER_WORKER_REPLICAS', '1'))
+# Winners at least this rare (0-10, as the confetti counts it) are drawn at
+# showcase size, and draws this far back in the render line at preview size
+SHOWCASE_RARITY = float(os.getenv('LOTTERY_SHOWCASE_RARITY', '9.5'))
+PREVIEW_LINE_POSITION = int(os.getenv('LOTTERY_PREVIEW_LINE_POSITION', '2'))
+# Kept-alive connections per host for API and media requests
+API_POOL_SIZE = int(os.getenv('API_POOL_SIZE', '20'))
+API_TIMEOUT = float(os.getenv('API_TIMEOUT', '30'))
 
 # Replace with the target user's name
 TARGET_USER = 'Hjerneskade(Meme Of The Day)'
@@ -58,7 +78,57 @@ intents.message_content = True
 intents.reactions = True
 intents.members = True
 
-bot = commands.Bot(command_prefix="!", intents=intents)
+api = ApiClient(API_HOST, MEDIA_HOST, BOT_SECRET, API_POOL_SIZE, API_TIMEOUT)
+render_queue = RenderQueue(RENDER_CONCURRENCY, RENDER_QUEUE_SIZE)
+renderer = RenderWorkerClient(RENDER_WORKER_URL, render_queue, RENDER_WORKER_REPLICAS)
+
+class MonsterBot(commands.Bot):
+    async def close(self):
+        await super().close()
+        await api.close()
+        await renderer.close()
+        render_queue.shutdown()
+
+bot = MonsterBot(command_prefix="!", intents=intents)
+
+def lottery_tier(items, winning_item, position=0):
+    # Rare wins get the big animation, a long line gets small ones, which
+    # have a quarter of the standard pixels
+    if position >= PREVIEW_LINE_POSITION:
+        return "preview"
+    if winner_rarity(items, winning_item) >= SHOWCASE_RARITY:
+        return "showcase"
+    return "standard"
+
+async def prerender_in_free_slot(items, winning_item):
+    # Pre-renders hold a place in the render line like live draws, so the
+    # line knows about them, but only start on a free slot. None tells the
+    # pre-render pool to try again later.
+    position = renderer.reserve()
+    if position is None:
+        return None
+    try:
+        if position:
+            return None
+        tier = lottery_tier(items, winning_item)
+        animation, _, _, _ = await renderer.lottery(items, winning_item, tier=tier, output_format=OUTPUT_FORMAT)
+        return io.BytesIO(animation)
+    except RenderBusy:
+        return None
+    finally:
+        renderer.release()
+
+def prerender(items, winning_item):
+    # Called on the pre-render pool's thread, renders like a live draw
+    # with the line empty
+    return asyncio.run_coroutine_threadsafe(prerender_in_free_slot(items, winning_item), bot.loop).result()
+
+# Lottery animations rendered ahead of time for the winners seen so far
+prerender_pool = PrerenderPool(prerender, PRERENDER_PER_ITEM, PRERENDER_MAX_BYTES)
+
+# "cprofile" or "tracemalloc", set by /profile_next_draw and used up by the
+# next lottery draw that renders live
+armed_profile_hook = None
 
 async def defer_ephemeral(interaction):
     await interaction.response.defer(ephemeral=True)
@@ -89,8 +159,8 @@ async def log_reaction(message, reaction, user):
     """Helper function to log reaction details."""
     emoji = reaction.emoji
     memeId = search_filename(message.attachments[0].filename)
-    headers, data = prepare_vote_data(user, memeId, str(emoji)[0])
-    await post_vote(bot.get_channel(reaction.message.channel.id), headers, data, False)
+    data = prepare_vote_data(user, memeId, str(emoji)[0])
+    await post_vote(bot.get_channel(reaction.message.channel.id), data, False)
 
 def react_to_message(message):
     for emoji in [f'{i}\N{COMBINING ENCLOSING KEYCAP}' for i in range(10)]:
@@ -102,6 +172,7 @@ async def on_ready():
     logger.info(f'lol {API_HOST}')
     logger.info(f"discord.py version: {pkg_resources.get_distribution('discord.py').version}")
     logger.info(f"requests version: {pkg_resources.get_distribution('requests').version}")
+    logger.info(f"aiohttp version: {pkg_resources.get_distribution('aiohttp').version}")
     logger.info(f"Pillow (PIL) version: {pkg_resources.get_distribution('Pillow').version}")
     logger.info(f"imageio version: {pkg_resources.get_distribution('imageio').version}")
     logger.info(f"python-dotenv version: {pkg_resources.get_distribution('python-dotenv').version}")
@@ -141,7 +212,7 @@ async def render_meme(interaction, visual_bytes, filename, top_text = None, bott
         "VisualFile": (filename, visual_bytes)
     }
     
-    response = requests.get(API_HOST + "Memes/Render", data=data, files=files)
+    response = await api.get("Memes/Render", data=data, files=files)
     
     if response.status_code == 200:
         file_bytes = io.BytesIO(response.content)
@@ -167,9 +238,6 @@ async def top_votable(
         await interaction.response.defer()
         if(is_Admin(interaction)):
             return await interaction.followup.send("You are not allowed, you are not cool enough.")
-        headers = {
-            'ExternalUserId': str(interaction.user.id)
-        }
 
         parameters = {
             "votableType": votable_type,
@@ -187,8 +255,7 @@ async def top_votable(
             parameters['topic'] = topic
 
 
-        url = API_HOST + "topics/LeaderBoard"
-        response = requests.get(url, headers=headers, params=parameters)
+        response = await api.get("topics/LeaderBoard", user_id=interaction.user.id, params=parameters)
         
         if response.status_code == 200:
             message = f"{'Top' if not order_ascending else 'Bottom'} {take_count} {votable_type}s in the given timespan !"
@@ -205,7 +272,7 @@ async def top_votable(
                 
                 bottom_text = data['BottomText']['data'] if data['BottomText'] is not None else "" 
 
-                response = requests.get(visual_url, stream=True)
+                response = await api.fetch(visual_url)
                 response.raise_for_status()
                 visual_file = io.BytesIO(response.content)
                 file_name = f"{votable['id']}_{data['Visual']['id']}_{data['TopText']['id'] if data['TopText'] is not None else ''}_{data['BottomText']['id'] if data['BottomText'] is not None else ''}.png"
@@ -239,10 +306,6 @@ async def submit_meme(
         file_bytes = await visual_file.read()
         if(not is_image(file_bytes)):
             return await interaction.followup.send(f"The given file is not an image. Please try again with a different file")
-        
-        headers = {
-            'ExternalUserId': str(interaction.user.id)
-        }
 
         data = {
             "TopText": top_text,
@@ -258,8 +321,8 @@ async def submit_meme(
         files = {
             "VisualFile": (visual_file.filename, file_bytes)
         }
-        url = API_HOST +  ("Memes?renderMeme=true" if not IS_DEVELOPMENT else "Memes")
-        response = requests.post(url, data=data, files=files, headers=headers)
+        path = "Memes?renderMeme=true" if not IS_DEVELOPMENT else "Memes"
+        response = await api.post(path, data=data, files=files, user_id=interaction.user.id)
         
         if response.status_code == 201:
             if(not IS_DEVELOPMENT):
@@ -283,7 +346,7 @@ async def render_meme_command(
 ):
     await interaction.response.defer()
     print(API_HOST + "Memes/random/rendered")
-    response = requests.get(API_HOST + "Memes/random/rendered")
+    response = await api.get("Memes/random/rendered")
     
     cd = response.headers.get("Content-Disposition")
 
@@ -332,36 +395,91 @@ async def render_meme_command(
 async def draw_ticket(
     interaction: discord.Interaction
 ):
+    global armed_profile_hook
+    position = None
     try:
         await interaction.response.defer()
 
-        headers = {
-            'Bot_Secret': BOT_SECRET,
-            'ExternalUserId': str(interaction.user.id)
-        }
+        # The draw counts as live from the start, so the pre-render pool
+        # doesn't start on this winner, or take a worker, while it runs
+        with prerender_pool.live_draw():
+            # Take a place in the render line before the ticket is paid for, so
+            # a full line turns the draw away without costing anything
+            position = renderer.reserve()
+            if position is None:
+                return await interaction.followup.send("The lottery machine is busy, try again in a moment.")
+
+            response = await api.post(f"Lotteries/{CURRENT_LOTTERY}/DrawTicket", user_id=interaction.user.id, bot_secret=True)
+            if response.status_code == 200:
+                #await interaction.followup.send("ticket drawn successfully!\n" + "```json\n" + format_json(response.text) + "\n```")
+                result = response.json()
+                wasFree = bool(result["wasFree"])
+                fps = 20
+
+                content = "FREE SPIN !!!" if wasFree else ""
+                animation_filename = f"gif.{OUTPUT_FORMATS[OUTPUT_FORMAT]['extension']}"
+
+                file_bytes = prerender_pool.take(result["items"], result["drawnItemWin"])
+                if file_bytes is not None:
+                    logger.info("Lottery animation served from the pre-render pool")
+                    await interaction.followup.send(content=content, file=discord.File(fp=file_bytes, filename=animation_filename))
+                else:
+                    # Show the winner right away, the animation replaces the card
+                    # once it is rendered
+                    card_bytes = await asyncio.to_thread(render_winner_card, result["drawnItemWin"])
+                    message = await interaction.followup.send(content=content, file=discord.File(fp=card_bytes, filename="winner.png"), wait=True)
+                    if position:
+                        await interaction.followup.send(f"You're #{position} in line, your animation is on its way.", ephemeral=True)
+                    profile_hook, armed_profile_hook = armed_profile_hook, None
+                    tier = lottery_tier(result["items"], result["drawnItemWin"], position)
+                    try:
+                        animation, render_report, render_summary, hook_report = await renderer.lottery(
+                            result["items"], result["drawnItemWin"], fps, profile_hook, tier, OUTPUT_FORMAT
+                        )
+                    except RenderBusy:
+                        return await interaction.followup.send("The lottery machine is too busy to animate this draw, the card above is your win.", ephemeral=True)
+                    file_bytes = io.BytesIO(animation)
+                    logger.info(f"Lottery animation rendered at {tier} size: {render_summary}")
+                    if hook_report:
+                        logger.info(f"Lottery animation {profile_hook} report:\n{hook_report}")
+                    if render_report["degradations"]:
+                        logger.info(f"Lottery animation degraded to fit its budget: {', '.join(render_report['degradations'])} ({render_report['bytes']} bytes in {render_report['seconds']:.1f}s)")
+                    try:
+                        await message.edit(attachments=[discord.File(fp=file_bytes, filename=animation_filename)])
+                    except discord.HTTPException:
+                        # The card is gone or can't be edited, send the animation on its own
+                        logger.info(traceback.format_exc())
+                        file_bytes.seek(0)
+                        await interaction.followup.send(content=content, file=discord.File(fp=file_bytes, filename=animation_filename))
+            elif response.status_code == 400:
+                await interaction.followup.send("Not enough dubloons.")
+            elif response.status_code == 409:
+                await interaction.followup.send("Lottery closed.")
+            else:
+                await interaction.followup.send("Failed to draw ticket. Status code: " + str(response.status_code))
 
-        response = requests.post(API_HOST + f"Lotteries/{CURRENT_LOTTERY}/DrawTicket", headers=headers)
-        if response.status_code == 200:
-            #await interaction.followup.send("ticket drawn successfully!\n" + "```json\n" + format_json(response.text) + "\n```")
-            result = response.json()
-            wasFree = bool(result["wasFree"])
-            fps = 20
-
-            file_bytes = generate_gif(result["items"], result["drawnItemWin"], fps)
-            await interaction.followup.send(content="FREE SPIN !!!" if wasFree else "", file=discord.File(fp=file_bytes, filename="gif.gif"))  
-        elif response.status_code == 400:
-            await interaction.followup.send("Not enough dubloons.")
-        elif response.status_code == 409:
-            await interaction.followup.send("Lottery closed.")
-        else:
-            await interaction.followup.send("Failed to draw ticket. Status code: " + str(response.status_code))
-                    
     except Exception as e:
         logger.info(e.__traceback__)
         logger.info(traceback.format_exc())
         await interaction.followup.send(f"An error occurred: {str(e)}")
+    finally:
+        if position is not None:
+            renderer.release()
+
 
 
+@bot.tree.command(name="profile_next_draw", description="Profile the next lottery draw that renders live")
+@app_commands.describe(hook="cprofile for where the time goes, tracemalloc for where the memory goes")
+async def profile_next_draw(
+    interaction: discord.Interaction,
+    hook: Literal["cprofile", "tracemalloc"]
+):
+    await defer_ephemeral(interaction)
+    if(is_Admin(interaction)):
+        return await interaction.followup.send("You are not allowed, you are not cool enough.")
+    global armed_profile_hook
+    armed_profile_hook = hook
+    await interaction.followup.send(f"The next lottery draw rendered live will be profiled with {hook}, the report goes to the log of whichever process renders it.")
 
 @bot.tree.command(name='submit_memetext', description='Submit a meme text')
 @app_commands.describe(text='The content to submit a meme with', position='The position in a meme, can be "toptext" or "bottomtext"', topics='Comma separated list of strings like so: ["Topic1","Topic2"]')
@@ -371,10 +489,6 @@ async def submit_memetext(interaction: discord.Interaction, text: str, position:
         await interaction.followup.send("Choose a position of either \"bottomtext\" or \"toptext\"")
         return
 
-    headers = {
-        'Content-Type': 'application/json',
-        'ExternalUserId': str(interaction.user.id)
-    }
     data = {
         'text': text,
         'position': position == "bottomtext",
@@ -389,7 +503,7 @@ async def submit_memetext(interaction: discord.Interaction, text: str, position:
             return await interaction.followup.send(f"Topics is not in a valid format. Please enter the topics in a JSON list like so: [\"Topic\", \"Topic2\"]")
     
     try:
-        response = requests.post(API_HOST + "texts", headers=headers, json=data)
+        response = await api.post("texts", user_id=interaction.user.id, json=data)
         
         if response.status_code == 201:
             await interaction.followup.send("Memetext created successfully!\n" + "```json\n" + format_json(response.text) + "\n```")
@@ -405,10 +519,6 @@ async def submit_memetext(interaction: discord.Interaction, text: str, position:
 async def submit_memetext(interaction: discord.Interaction, text: str, topics: str = None):
     await defer_ephemeral(interaction)
     
-    headers = {
-        'Content-Type': 'application/json',
-        'ExternalUserId': str(interaction.user.id)
-    }
     data = {
         'text': text,
         'position': True,
@@ -423,7 +533,7 @@ async def submit_memetext(interaction: discord.Interaction, text: str, topics: s
             return await interaction.followup.send(f"Topics is not in a valid format. Please enter the topics in a JSON list like so: [\"Topic\", \"Topic2\"]")
     
     try:
-        response = requests.post(API_HOST + "texts", headers=headers, json=data)
+        response = await api.post("texts", user_id=interaction.user.id, json=data)
         
         if response.status_code == 201:
             await interaction.followup.send("Memetext created successfully!\n" + "```json\n" + format_json(response.text) + "\n```")
@@ -440,10 +550,6 @@ async def submit_memetext(interaction: discord.Interaction, text: str, topics: s
 @app_commands.describe(text='The content to submit', topics='Comma separated list of strings like so: ["Topic1","Topic2"]')
 async def submit_toptext(interaction: discord.Interaction, text: str, topics: str = None):
     await defer_ephemeral(interaction)
-    headers = {
-        'Content-Type': 'application/json',
-        'ExternalUserId': str(interaction.user.id)
-    }
     data = {
         'text': text,
         'position': False,
@@ -458,7 +564,7 @@ async def submit_toptext(interaction: discord.Interaction, text: str, topics: st
             return await interaction.followup.send(f"Topics is not in a valid format. Please enter the topics in a JSON list like so: [\"Topic\", \"Topic2\"]")
     
     try:
-        response = requests.post(API_HOST + "texts", headers=headers, json=data)
+        response = await api.post("texts", user_id=interaction.user.id, json=data)
         
         if response.status_code == 201:
             await interaction.followup.send("Memetext created successfully!\n" + "```json\n" + format_json(response.text) + "\n```")
@@ -473,11 +579,6 @@ async def submit_toptext(interaction: discord.Interaction, text: str, topics: st
 @app_commands.describe(scope='There are currently two scopes, place submissions and dubloon transfer', third_party_url='Optionally give the url of the third party to prefill the authentication output.')
 async def authenticate_third_party(interaction: discord.Interaction, scope: Literal["submit_place", "transfer_dubloons"], third_party_url: str = None):
     await defer_ephemeral(interaction)
-    headers = {
-        'Content-Type': 'application/json',
-        'Bot_Secret': BOT_SECRET,
-        'ExternalUserId': str(interaction.user.id)
-    }
     if third_party_url == None:
         if(scope == "submit_place"):
             third_party_url = CANVAS_HOST
@@ -485,7 +586,7 @@ async def authenticate_third_party(interaction: discord.Interaction, scope: Lite
             third_party_url = TRADING_HOST
     
     try:
-        response = requests.post(API_HOST + "auth/initiate", headers=headers, json=scope)
+        response = await api.post("auth/initiate", user_id=interaction.user.id, bot_secret=True, json=scope)
         
         if response.status_code == 200:
             response_data = json.loads(response.text)
@@ -502,14 +603,9 @@ async def authenticate_third_party(interaction: discord.Interaction, scope: Lite
 @app_commands.describe()
 async def revoke_third_party_authentications(interaction: discord.Interaction):
     await defer_ephemeral(interaction)
-    headers = {
-        'Content-Type': 'application/json',
-        'Bot_Secret': BOT_SECRET,
-        'ExternalUserId': str(interaction.user.id)
-    }
     
     try:
-        response = requests.post(API_HOST + "auth/revoke-all", headers=headers)
+        response = await api.post("auth/revoke-all", user_id=interaction.user.id, bot_secret=True)
         response_data = json.loads(response.text)
         if response.status_code == 200:
             await interaction.followup.send("Success!\n" + "You now have revoked " + str(response_data["revoked"]) + " tokens")
@@ -529,16 +625,11 @@ async def delete_votable(interaction: discord.Interaction, id: str, hard_delete:
 
 async def delete_element(interaction, id, endpoint, hard_delete = False):
     try:
-        headers = {
-            'Bot_Secret': BOT_SECRET,
-            'ExternalUserId': str(interaction.user.id)
-        }
-
         params = {
             'hardDelete': hard_delete
         }
 
-        response = requests.delete(API_HOST + endpoint + id, headers=headers, params=params)
+        response = await api.delete(endpoint + id, user_id=interaction.user.id, bot_secret=True, params=params)
         
         if response.status_code == 200 or response.status_code == 204:
             await interaction.followup.send("Element deleted successfully!")
@@ -556,13 +647,13 @@ async def vote(interaction: discord.Interaction, elementid: str, votenumber: int
     if(votenumber < 0 or votenumber > 9):
         return await interaction.followup.send("VoteNumber Invalid value: VoteNumber can only be an integer from 0-9.")
 
-    headers, data = prepare_vote_data(interaction.user, elementid, votenumber)
+    data = prepare_vote_data(interaction.user, elementid, votenumber)
     
-    await post_vote(interaction.followup, headers, data, True)
+    await post_vote(interaction.followup, data, True)
 
-async def post_vote(followup, headers, data, should_post_success):
+async def post_vote(followup, data, should_post_success):
     try:
-        response = requests.post(API_HOST + "votes", headers=headers, data=data)
+        response = await api.post("votes", bot_secret=True, data=data)
     
         if response.status_code == 201 or response.status_code == 200:
             if should_post_success:
@@ -575,9 +666,6 @@ async def post_vote(followup, headers, data, should_post_success):
         await followup.send(f"An error occurred: {str(e)}")
 
 def prepare_vote_data(user, elementid, votenumber):
-    headers = {
-        'Bot_Secret': BOT_SECRET
-    }
     data = {
         'ElementIDs': [elementid],
         'VoteNumber': votenumber,
@@ -585,7 +673,7 @@ def prepare_vote_data(user, elementid, votenumber):
         'ExternalUserName': user.name,
     }
     
-    return headers,data
+    return data
 
 @bot.tree.command(name='transfer', description='Transfer dubloons from your account to another account')
 @app_commands.describe(dublooncount='The number of dubloons that you want to tranfer(whole positive number)', user='The name of the user that you want to transfer to.')
@@ -596,11 +684,6 @@ async def vote(interaction: discord.Interaction, dublooncount: int, user: discor
 
     if(interaction.user.id == user.id):
         return await interaction.followup.send("You cannot transfer dubloons to yourself, please provide another user")
-    
-    headers = {
-        'Bot_Secret': BOT_SECRET,
-        'ExternalUserId': str(interaction.user.id)
-    }
 
     data = {
         "OtherUserId": user.id,
@@ -608,7 +691,7 @@ async def vote(interaction: discord.Interaction, dublooncount: int, user: discor
         "DubloonsToTransfer": dublooncount,
     }
     try:
-        response = requests.post(API_HOST + "users/Transfer", headers=headers, data=data)
+        response = await api.post("users/Transfer", user_id=interaction.user.id, bot_secret=True, data=data)
         if response.status_code == 200:
             if(user.id == bot.user.id):
                 return await interaction.followup.send("Transfer successful! You have succesfully donated "+ str(dublooncount) + " to me... the bot")    
@@ -632,12 +715,7 @@ async def current_price_per_pixel(
             return await interaction.followup.send("You are not allowed, you are not cool enough.")
         await defer_ephemeral(interaction)
 
-        headers = {
-            'Bot_Secret': BOT_SECRET,
-            'ExternalUserId': str(interaction.user.id)
-        }
-
-        response = requests.put(API_HOST + f"topics/{CURRENT_TOPICID}/mod/{user.id}", headers=headers)
+        response = await api.put(f"topics/{CURRENT_TOPICID}/mod/{user.id}", user_id=interaction.user.id, bot_secret=True)
 
         if response.status_code == 200:
             await interaction.followup.send("The user was sucessfully modded", ephemeral=True)
@@ -663,9 +741,6 @@ async def submit_memevisual(
         if(not is_image(file_bytes)):
             return await interaction.followup.send(f"The given file is not an image. Please try again with a different file")
         
-        headers = {
-            'ExternalUserId': str(interaction.user.id)
-        }
         data = {
         }
 
@@ -694,7 +769,7 @@ async def submit_memevisual(
             "File": (file.filename, file_bytes)
         }       
 
-        response = requests.post(API_HOST + "Visuals", data=data, headers=headers, files=files)
+        response = await api.post("Visuals", data=data, files=files, user_id=interaction.user.id)
         
         if response.status_code == 201:
             await interaction.followup.send("MemeVisual created successfully!\n" + "```json\n" + format_json(response.text) + "\n```")
@@ -733,14 +808,10 @@ async def submit_placesubmission(
         
         file_bytes = await file.read()
         if file.filename.endswith('.webp'):
-            uploaded_image = Image.open(io.BytesIO(file_bytes))
-            png_image_io = io.BytesIO()
-            uploaded_image.save(png_image_io, format="PNG")
-            png_image_io.seek(0)
-            file_bytes = png_image_io.getvalue()
+            file_bytes = await renderer.png(file_bytes)
             file = discord.File(io.BytesIO(file_bytes), filename=file.filename.replace('.webp', '.png'))  # Overwrite file as PNG
 
-        response = requests.get(MEDIA_HOST + f"places/{CURRENT_PLACEID}_latest.png")
+        response = await api.media(f"places/{CURRENT_PLACEID}_latest.png")
 
         if response.status_code != 200:
             return await interaction.followup.send("Something went wrong in retrieving the current place. Please try again later.", ephemeral=True)
@@ -759,13 +830,11 @@ async def submit_placesubmission(
         if file.filename != f"{reference_image_render_timestamp}.png":
             return await interaction.followup.send(f"You have either based your changes off an older version of the current place or changed the name of the file. Please download the latest Place render and try again.", ephemeral=True)
 
-        uploaded_image = Image.open(io.BytesIO(file_bytes))
-
-        response = requests.get(API_HOST + f"MemePlaces/{CURRENT_PLACEID}/currentprice")
+        response = await api.get(f"MemePlaces/{CURRENT_PLACEID}/currentprice")
 
         current_price = float(json.loads(response.text)["pricePerPixel"])
 
-        diff_pixels = count_pixel_changes(uploaded_image, Image.open(reference_image))
+        diff_pixels = await renderer.pixel_changes(file_bytes, reference_image.getvalue())
         if(diff_pixels == None):
             return await interaction.followup.send(f"The image you have submitted is not the same resolution as the current place image. Please download the latest place and try again.", ephemeral=True)
 
@@ -774,7 +843,7 @@ async def submit_placesubmission(
         
         required_funds = math.ceil(diff_pixels * current_price)
 
-        response = requests.get(API_HOST + f"users/{interaction.user.id}/Dubloons")
+        response = await api.get(f"users/{interaction.user.id}/Dubloons")
         if response.status_code == 200:
             user_dubloons = int(float(response.content.decode()))
             if user_dubloons < required_funds:
@@ -792,11 +861,10 @@ async def submit_placesubmission(
             return await interaction.followup.send("Submission cancelled.", ephemeral=True)
         else:
             await interaction.followup.send("Proceeding with submission. Please wait.", ephemeral=True)
-        headers = {'ExternalUserId': str(interaction.user.id)}
         data = {"PlaceId": CURRENT_PLACEID}
         files = {"ImageWithChanges": (file.filename, file_bytes)}
 
-        response = requests.post(API_HOST + f"MemePlaces/submissions/submit", data=data, headers=headers, files=files)
+        response = await api.post("MemePlaces/submissions/submit", data=data, files=files, user_id=interaction.user.id)
 
         if response.status_code == 200:
             return await interaction.followup.send("PlaceSubmission submitted successfully!\n" + "\n```json\n" + format_json(response.text) + "\n```", ephemeral=True)
@@ -809,22 +877,6 @@ async def submit_placesubmission(
         await interaction.followup.send(f"An error occurred: {str(e)}", ephemeral=True)
 
 
-def count_pixel_changes(img1, img2):
-    img1 = img1.convert('RGBA')
-    img2 = img2.convert('RGBA')
-    img1_height, img1_width = img1.size
-    img2_height, img2_width = img2.size
-
-    if(img1_height != img2_height or img1_width != img2_width):
-        return None
-
-    diff = ImageChops.difference(img1, img2)
-
-    diff_pixels = sum(pixel != (0, 0, 0, 0) for pixel in diff.getdata())
-
-    return diff_pixels
-
-
 @bot.tree.command(name='delete_place_submission', description='Delete a place submission')
 @app_commands.describe(id='The ID of the place submission to be deleted.')
 async def delete_place_submission(interaction: discord.Interaction, id: str):
@@ -843,7 +895,7 @@ async def current_price_per_pixel(
     try:
         await defer_ephemeral(interaction)
 
-        response = requests.get(API_HOST + f"MemePlaces/{CURRENT_PLACEID}/currentprice")
+        response = await api.get(f"MemePlaces/{CURRENT_PLACEID}/currentprice")
 
         if response.status_code == 200:
             await interaction.followup.send("The current price is \n" + "```json\n" + format_json(response.text) + "\n```", ephemeral=True)
@@ -866,16 +918,13 @@ async def change_price_per_pixel(
         await defer_ephemeral(interaction)
         if(interaction.user.id != 319532244463255552):
             return await interaction.followup.send("You are not allowed to change the price")
-        headers = {
-            'Bot_Secret': BOT_SECRET
-        }
         
         data = {
             'PlaceId': CURRENT_PLACEID,
             'NewPricePerPixel': new_price_per_pixel,
         }
 
-        response = requests.post(API_HOST + f"MemePlaces/ChangePrice", data=data, headers=headers)
+        response = await api.post("MemePlaces/ChangePrice", bot_secret=True, data=data)
 
         if response.status_code == 200:
             await interaction.followup.send("The current place's price per pixel successfully changed! The new price is \n" + "```json\n" + format_json(response.text) + "\n```", ephemeral=True)
@@ -894,10 +943,7 @@ async def rerender(
 ):
     try:
         await defer_ephemeral(interaction)
-        headers = {
-            'Bot_Secret': BOT_SECRET
-        }
-        response = requests.post(API_HOST + f"MemePlaces/{CURRENT_PLACEID}/rerender", headers=headers)
+        response = await api.post(f"MemePlaces/{CURRENT_PLACEID}/rerender", bot_secret=True)
 
         if response.status_code == 200:
             await interaction.followup.send(content="Place succesfully rerendered.")
@@ -916,7 +962,7 @@ async def latest_place(
 ):
     try:
         await defer_ephemeral(interaction)
-        response = requests.get(MEDIA_HOST + f"places/{CURRENT_PLACEID}_latest.png")
+        response = await api.media(f"places/{CURRENT_PLACEID}_latest.png")
 
         if response.status_code == 200:
             file_bytes = io.BytesIO(response.content)
@@ -968,7 +1014,7 @@ async def dubloons(
         user_id = interaction.user.id
         if(user is not None):
             user_id = user.id
-        response = requests.get(API_HOST + f"users/{user_id}/Dubloons")
+        response = await api.get(f"users/{user_id}/Dubloons")
 
         if response.status_code == 200:
             msg = f"You have {int(float(response.content.decode()))} dubloons!"
@@ -993,8 +1039,7 @@ async def dubloons(
 ):
     try:
         await defer_ephemeral(interaction)
-        headers = {'ExternalUserId': str(user.id if user != None else interaction.user.id)}
-        response = requests.get(API_HOST + f"Lotteries/{CURRENT_LOTTERY}/receipt", headers=headers)
+        response = await api.get(f"Lotteries/{CURRENT_LOTTERY}/receipt", user_id=user.id if user != None else interaction.user.id)
 
         if response.status_code == 200:
             message = "Your receipt \n" + "```json\n" + format_json(response.text) + "\n```"
@@ -1018,7 +1063,7 @@ async def git_blame(
 ):
     try:
         await defer_ephemeral(interaction)
-        response = requests.get(API_HOST + f"memes/{meme_id}")
+        response = await api.get(f"memes/{meme_id}")
 
         if response.status_code == 200:
             message = f"These people are responsible for the abomination" + "```json\n" + format_json(json.dumps(extract_owners(response.text))) + "\n```"
@@ -1039,7 +1084,7 @@ async def git_blame_menu(interaction: discord.Interaction, message: discord.Mess
     try:
         if message.attachments:
             meme_id = search_filename(message.attachments[0].filename)
-            response = requests.get(API_HOST + f"memes/{meme_id}")
+            response = await api.get(f"memes/{meme_id}")
             if response.status_code == 200:
                 
                 message = f"These people are responsible for the abomination" + "```json\n" + format_json(json.dumps(extract_owners(response.text))) + "\n```"
@@ -1085,4 +1130,7 @@ def extract_owners(meme):
 
     return owners
 
-bot.run(TOKEN)
+# Render workers are spawned and import this module again, they must not
+# start the bot
+if __name__ == "__main__":
+    bot.run(TOKEN)
@@ -0,0 +1,138 @@
+from collections import deque
+import contextlib
+import io
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class PrerenderPool:
+    """
+    Ready-made lottery animations, up to per_item for every possible winner.
+
+    Only the winner is unknown before a draw, so a background thread renders
+    animations for the items seen so far while no live draw is running, and
+    take() hands one out instantly. Winners are learned from the draws
+    themselves, since only DrawTicket returns an item's name and picture.
+    The pool holds at most max_bytes of animations and starts over when the
+    lottery's item set changes.
+
+    render(items, winning_item) returns the animation as a BytesIO, or None
+    when there is no room to render right now. The pool then tries again
+    once a live draw ends, or after retry_delay seconds.
+    """
+
+    def __init__(self, render, per_item=2, max_bytes=64 * 1024 * 1024, retry_delay=5):
+        self.render = render
+        self.per_item = per_item
+        self.max_bytes = max_bytes
+        self.retry_delay = retry_delay
+        self.items = None
+        self.signature = None
+        self.winners = {}
+        self.ready = {}
+        self.total_bytes = 0
+        self.largest = 0
+        self.live_draws = 0
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def take(self, items, winning_item):
+        """
+        Return a ready animation of winning_item as a BytesIO, or None.
+
+        Also records items and winning_item, so the pool can refill for them.
+        """
+        if self.per_item <= 0:
+            return None
+        key = winning_item['itemThumbnailURL']
+        with self.condition:
+            self.update(items, winning_item)
+            ready = self.ready.get(key)
+            animation = ready.popleft() if ready else None
+            if animation is not None:
+                self.total_bytes -= len(animation)
+            self.condition.notify_all()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="prerender", daemon=True)
+            self.thread.start()
+        return io.BytesIO(animation) if animation is not None else None
+
+    @contextlib.contextmanager
+    def live_draw(self):
+        # The pool only starts renders while no draw is running. Enter this
+        # before take(), which wakes the pool up for a winner it lacks.
+        with self.condition:
+            self.live_draws += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.live_draws -= 1
+                self.condition.notify_all()
+
+    def update(self, items, winning_item):
+        # Called with the condition held
+        signature = tuple(
+            (item.get('itemThumbnailURL'), item.get('itemRarityColor'), item.get('itemRarity')) for item in items
+        )
+        if signature != self.signature:
+            if self.signature is not None:
+                logger.info("Lottery items changed, dropping pre-rendered animations")
+            self.signature = signature
+            self.items = list(items)
+            self.winners = {}
+            self.ready = {}
+            self.total_bytes = 0
+        key = winning_item['itemThumbnailURL']
+        if self.winners.get(key) != winning_item:
+            self.total_bytes -= sum(len(animation) for animation in self.ready.get(key, ()))
+            self.winners[key] = dict(winning_item)
+            self.ready[key] = deque()
+
+    def next_job(self):
+        # The winner with the fewest ready animations, or None if nothing is
+        # due. Stops short of the cap rather than render what can't be kept.
+        if self.live_draws or self.total_bytes + self.largest > self.max_bytes:
+            return None
+        due = [key for key in self.winners if len(self.ready[key]) < self.per_item]
+        if not due:
+            return None
+        key = min(due, key=lambda key: len(self.ready[key]))
+        return self.signature, self.items, self.winners[key]
+
+    def run(self):
+        while True:
+            with self.condition:
+                job = self.next_job()
+                while job is None:
+                    self.condition.wait()
+                    job = self.next_job()
+            signature, items, winning_item = job
+            key = winning_item['itemThumbnailURL']
+            try:
+                animation = self.render(items, winning_item)
+            except Exception:
+                logger.exception(f"Failed to pre-render {key}")
+                # Forget the winner until a draw brings it back, instead of
+                # failing on it over and over
+                with self.condition:
+                    if self.winners.get(key) == winning_item:
+                        self.total_bytes -= sum(len(animation) for animation in self.ready.pop(key))
+                        del self.winners[key]
+                continue
+            if animation is None:
+                with self.condition:
+                    self.condition.wait(self.retry_delay)
+                continue
+            animation = animation.getvalue()
+
+            with self.condition:
+                self.largest = max(self.largest, len(animation))
+                # The lottery may have changed while this was rendering
+                if signature != self.signature or self.winners.get(key) != winning_item:
+                    continue
+                if self.total_bytes + len(animation) > self.max_bytes:
+                    continue
+                self.ready[key].append(animation)
+                self.total_bytes += len(animation)
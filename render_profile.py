@@ -0,0 +1,120 @@
+from collections import Counter
+import contextlib
+import cProfile
+import io
+import pstats
+import threading
+import time
+import tracemalloc
+
+class RenderProfile:
+    """
+    Timings and counters for one generate_gif call.
+
+    Stages record their wall time and the CPU time of the thread that ran
+    them, since the pipeline runs stages on different threads at once, plus
+    the frames and bytes they produced. Counters hold things like thumbnail
+    cache hits. With hook="cprofile" or hook="tracemalloc" the call is also
+    profiled, and hook_report holds the result.
+    """
+
+    HOOKS = ("cprofile", "tracemalloc")
+
+    def __init__(self, hook=None):
+        if hook not in (None, *self.HOOKS):
+            raise ValueError(f"Unknown profile hook {hook!r}, expected one of {self.HOOKS}")
+        self.hook = hook
+        self.stages = {}
+        self.counters = Counter()
+        self.wall = 0.0
+        self.hook_report = None
+        self.lock = threading.Lock()
+        self.profiles = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        # Stages with the same name add up
+        profiler = None
+        if self.hook == "cprofile":
+            # cProfile only sees the thread it was enabled on
+            profiler = cProfile.Profile()
+            profiler.enable()
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            cpu = time.thread_time() - cpu_start
+            wall = time.perf_counter() - wall_start
+            if profiler is not None:
+                profiler.disable()
+            with self.lock:
+                stage = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "frames": 0, "bytes": 0})
+                stage["wall"] += wall
+                stage["cpu"] += cpu
+                if profiler is not None:
+                    self.profiles.append(profiler)
+
+    def add(self, name, frames=0, bytes=0):
+        with self.lock:
+            stage = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "frames": 0, "bytes": 0})
+            stage["frames"] += frames
+            stage["bytes"] += bytes
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    @contextlib.contextmanager
+    def call(self):
+        # Wraps the whole call, starts and stops the hook
+        started_tracing = False
+        if self.hook == "tracemalloc" and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            started_tracing = True
+        wall_start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.wall = time.perf_counter() - wall_start
+            if self.hook == "tracemalloc" and tracemalloc.is_tracing():
+                self.hook_report = self.tracemalloc_report()
+                if started_tracing:
+                    tracemalloc.stop()
+            elif self.hook == "cprofile" and self.profiles:
+                self.hook_report = self.cprofile_report()
+
+    def cprofile_report(self, limit=25):
+        output = io.StringIO()
+        stats = pstats.Stats(self.profiles[0], stream=output)
+        for profiler in self.profiles[1:]:
+            stats.add(profiler)
+        stats.sort_stats("cumulative").print_stats(limit)
+        return output.getvalue()
+
+    def tracemalloc_report(self, limit=10):
+        _, peak = tracemalloc.get_traced_memory()
+        lines = [f"peak traced memory {peak / 2 ** 20:.1f} MB, largest live allocations:"]
+        for statistic in tracemalloc.take_snapshot().statistics("lineno")[:limit]:
+            lines.append(f"  {statistic}")
+        return "\n".join(lines)
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                "wall": self.wall,
+                "stages": {name: dict(stage) for name, stage in self.stages.items()},
+                "counters": dict(self.counters),
+            }
+
+    def summary(self):
+        # One line, for logs
+        with self.lock:
+            stages = ", ".join(
+                f"{name} {stage['wall']:.3f}s wall/{stage['cpu']:.3f}s cpu"
+                + (f" {stage['frames']} frames" if stage["frames"] else "")
+                + (f" {stage['bytes']} bytes" if stage["bytes"] else "")
+                for name, stage in self.stages.items()
+            )
+            counters = ", ".join(f"{name} {value}" for name, value in sorted(self.counters.items()))
+        return f"{self.wall:.3f}s total; {stages}" + (f"; {counters}" if counters else "")
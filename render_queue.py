@@ -0,0 +1,95 @@
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import multiprocessing
+from gif import OUTPUT_FORMAT, generate_gif
+from render_profile import RenderProfile
+
+logger = logging.getLogger(__name__)
+
+def render_lottery(items, winning_item, fps=20, profile_hook=None, tier="standard", output_format=OUTPUT_FORMAT):
+    """
+    Render a lottery animation in a worker process.
+
+    Returns the animation bytes, generate_gif's report, and the profile
+    summary and hook report as strings, since the profile itself can't be
+    sent back between processes.
+    """
+    report = {}
+    profile = RenderProfile(hook=profile_hook)
+    animation = generate_gif(items, winning_item, fps, output_format=output_format, report=report, tier=tier, profile=profile)
+    return animation.getvalue(), report, profile.summary(), profile.hook_report
+
+class RenderLine:
+    """
+    The line of renders waiting for concurrency render slots.
+
+    Up to max_waiting renders wait for a free slot, and reserve() turns
+    away anything beyond that, so a rush can't pile up more renders than
+    the slots get through. Reservations are only counted on the event loop,
+    so they need no lock.
+    """
+
+    def __init__(self, concurrency=2, max_waiting=8):
+        self.concurrency = max(1, concurrency)
+        self.max_waiting = max_waiting
+        self.jobs = 0
+
+    def reserve(self):
+        """
+        Reserve a place for one render, release() gives it back.
+
+        Returns 0 if a slot is free, N if the render is N-th in line, or
+        None if the line is full.
+        """
+        position = max(0, self.jobs - self.concurrency + 1)
+        if position > self.max_waiting:
+            return None
+        self.jobs += 1
+        return position
+
+    def release(self):
+        self.jobs -= 1
+
+class RenderQueue(RenderLine):
+    """
+    Runs lottery renders in a process pool, off the bot's event loop.
+
+    The pool has one worker per slot of the line, so at most concurrency
+    renders run at once.
+    """
+
+    def __init__(self, concurrency=2, max_waiting=8):
+        super().__init__(concurrency, max_waiting)
+        self.pool = None
+
+    def executor(self):
+        # Spawned rather than forked, the bot process has an event loop and
+        # threads. Workers start on the first render.
+        if self.pool is None:
+            self.pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.concurrency,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self.pool
+
+    async def run(self, fn, *args, **kwargs):
+        pool = self.executor()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, functools.partial(fn, *args, **kwargs))
+        except concurrent.futures.process.BrokenProcessPool:
+            self.forget(pool)
+            raise
+
+    def forget(self, pool):
+        # A worker died, the next render starts a new pool
+        logger.warning("Render worker died, restarting the render pool")
+        if self.pool is pool:
+            self.pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
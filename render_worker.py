@@ -0,0 +1,207 @@
+"""
+Render worker service for the bot's CPU-heavy jobs.
+
+Runs lottery animations, place pixel diffs and PNG conversions over a small
+HTTP API, in its own process pool:
+
+    POST /lottery        JSON {items, winning_item, fps, profile_hook, tier, output_format}
+                         -> the animation, with its report in X-Render-Report
+    POST /pixel-changes  form with files image and reference
+                         -> JSON {"changed": pixels, or null if the sizes differ}
+    POST /png            form with file image -> the image as PNG
+    GET  /health
+
+    python render_worker.py
+
+Any number of replicas can run behind one host name. A replica answers 503
+when its line is full. RenderWorkerClient, the bot's side, then tells the
+user the workers are busy, and only renders in the bot process when no
+worker answers at all.
+"""
+from aiohttp import web
+import asyncio
+import json
+import logging
+import os
+import aiohttp
+from image_jobs import convert_to_png, count_pixel_changes_in_files
+from gif import OUTPUT_FORMAT, OUTPUT_FORMATS
+from render_queue import RenderLine, RenderQueue, render_lottery
+
+logger = logging.getLogger(__name__)
+
+RENDER_WORKER_HOST = os.getenv('RENDER_WORKER_HOST', '0.0.0.0')
+RENDER_WORKER_PORT = int(os.getenv('RENDER_WORKER_PORT', '8090'))
+# Uploaded places can be large, aiohttp allows 1 MB by default
+RENDER_WORKER_MAX_BYTES = int(os.getenv('RENDER_WORKER_MAX_BYTES', str(32 * 1024 * 1024)))
+RENDER_CONCURRENCY = int(os.getenv('RENDER_CONCURRENCY', '2'))
+RENDER_QUEUE_SIZE = int(os.getenv('RENDER_QUEUE_SIZE', '8'))
+
+async def run_job(request, fn, *args):
+    render_queue = request.app["render_queue"]
+    if render_queue.reserve() is None:
+        raise web.HTTPServiceUnavailable(text="Render queue is full")
+    try:
+        return await render_queue.run(fn, *args)
+    finally:
+        render_queue.release()
+
+async def read_files(request, *names):
+    form = await request.post()
+    try:
+        return [form[name].file.read() for name in names]
+    except (KeyError, AttributeError):
+        raise web.HTTPBadRequest(text=f"Expected files {', '.join(names)}")
+
+async def lottery(request):
+    job = await request.json()
+    # The bot names the format, so the animation matches its file extension
+    output_format = job.get("output_format", OUTPUT_FORMAT)
+    if output_format not in OUTPUT_FORMATS:
+        raise web.HTTPBadRequest(text=f"Unknown output format {output_format!r}")
+    animation, report, summary, hook_report = await run_job(
+        request, render_lottery, job["items"], job["winning_item"], job.get("fps", 20), job.get("profile_hook"),
+        job.get("tier", "standard"), output_format,
+    )
+    logger.info(f"Lottery animation rendered: {summary}")
+    if hook_report:
+        logger.info(f"Lottery animation {job.get('profile_hook')} report:\n{hook_report}")
+    return web.Response(
+        body=animation,
+        content_type="application/octet-stream",
+        headers={"X-Render-Report": json.dumps(report), "X-Render-Summary": summary},
+    )
+
+async def pixel_changes(request):
+    image, reference = await read_files(request, "image", "reference")
+    return web.json_response({"changed": await run_job(request, count_pixel_changes_in_files, image, reference)})
+
+async def png(request):
+    image, = await read_files(request, "image")
+    return web.Response(body=await run_job(request, convert_to_png, image), content_type="image/png")
+
+async def health(request):
+    return web.json_response({"jobs": request.app["render_queue"].jobs})
+
+def make_app(render_queue):
+    app = web.Application(client_max_size=RENDER_WORKER_MAX_BYTES)
+    app["render_queue"] = render_queue
+    app.router.add_post("/lottery", lottery)
+    app.router.add_post("/pixel-changes", pixel_changes)
+    app.router.add_post("/png", png)
+    app.router.add_get("/health", health)
+    app.on_cleanup.append(lambda app: asyncio.to_thread(render_queue.shutdown))
+    return app
+
+class RenderBusy(Exception):
+    pass
+
+class RenderWorkerClient:
+    """
+    The bot's side of the render workers.
+
+    With url set, jobs go to the workers. line then counts the draws they
+    are running or queueing, as replicas workers with render_queue's
+    concurrency and line length each. A worker with a full line answers
+    503, which raises RenderBusy rather than move the job into the bot.
+    Only when no worker answers, or one fails, does a job run on
+    render_queue in the bot process, holding a place in its line. Without
+    url, line is render_queue itself and every job runs there.
+
+    Every request opens a new connection, so replicas behind one host name
+    share the jobs between them instead of one keeping a kept-alive connection.
+    """
+
+    def __init__(self, url, render_queue, replicas=1, timeout=120):
+        self.url = url.rstrip("/") + "/" if url else None
+        self.render_queue = render_queue
+        if self.url:
+            self.line = RenderLine(render_queue.concurrency * replicas, render_queue.max_waiting * replicas)
+        else:
+            self.line = render_queue
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.session = None
+
+    def reserve(self):
+        # A place in line for one draw, see RenderLine.reserve
+        return self.line.reserve()
+
+    def release(self):
+        self.line.release()
+
+    async def post(self, path, **kwargs):
+        # The response body and headers, or None if no worker could do the job
+        if self.url is None:
+            return None
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(force_close=True, use_dns_cache=False)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        try:
+            async with self.session.post(self.url + path, **kwargs) as response:
+                if response.status == 200:
+                    return await response.read(), response.headers
+                if response.status == 503:
+                    raise RenderBusy("The render workers are busy, try again in a moment.")
+                logger.warning(f"Render worker answered {path} with {response.status}: {await response.text()}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Render worker unavailable for {path}: {e!r}")
+        return None
+
+    async def run_locally(self, fn, *args):
+        if self.url is None:
+            return await self.render_queue.run(fn, *args)
+        # The workers are down, the job waits in the bot's own line instead
+        if self.render_queue.reserve() is None:
+            raise RenderBusy("The render workers are down and the bot is busy, try again in a moment.")
+        try:
+            return await self.render_queue.run(fn, *args)
+        finally:
+            self.render_queue.release()
+
+    def files_form(self, **files):
+        form = aiohttp.FormData()
+        for name, content in files.items():
+            form.add_field(name, content, filename=name)
+        return form
+
+    async def lottery(self, items, winning_item, fps=20, profile_hook=None, tier="standard", output_format=OUTPUT_FORMAT):
+        # Same result as render_lottery, without the hook report, which
+        # the worker logs itself
+        job = {
+            "items": items, "winning_item": winning_item, "fps": fps, "profile_hook": profile_hook,
+            "tier": tier, "output_format": output_format,
+        }
+        result = await self.post("lottery", json=job)
+        if result is None:
+            return await self.run_locally(render_lottery, items, winning_item, fps, profile_hook, tier, output_format)
+        animation, headers = result
+        return animation, json.loads(headers["X-Render-Report"]), headers["X-Render-Summary"], None
+
+    async def pixel_changes(self, image_bytes, reference_bytes):
+        result = await self.post("pixel-changes", data=self.files_form(image=image_bytes, reference=reference_bytes))
+        if result is None:
+            return await self.run_locally(count_pixel_changes_in_files, image_bytes, reference_bytes)
+        return json.loads(result[0])["changed"]
+
+    async def png(self, image_bytes):
+        result = await self.post("png", data=self.files_form(image=image_bytes))
+        if result is None:
+            return await self.run_locally(convert_to_png, image_bytes)
+        return result[0]
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    render_queue = RenderQueue(RENDER_CONCURRENCY, RENDER_QUEUE_SIZE)
+    web.run_app(make_app(render_queue), host=RENDER_WORKER_HOST, port=RENDER_WORKER_PORT, print=None)
+
+# The render pool's workers are spawned and import this module again
+if __name__ == "__main__":
+    main()
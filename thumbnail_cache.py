@@ -0,0 +1,188 @@
+from PIL import Image
+from collections import OrderedDict
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+import requests
+
+logger = logging.getLogger(__name__)
+
+def ignore_count(name):
+    pass
+
+class ThumbnailCache:
+    """
+    Two-tier cache for lottery item thumbnails.
+
+    Ready-made tiles live in an in-memory LRU keyed by URL and variant. The
+    downloaded bytes live on disk keyed by URL, next to the ETag and
+    Last-Modified headers they came with. Entries older than max_age are
+    revalidated with a conditional request, and the disk tier evicts the
+    least recently used files once it grows past max_disk_bytes.
+    """
+
+    def __init__(self, directory, max_memory_items=256, max_disk_bytes=64 * 1024 * 1024, max_age=600, session=None, timeout=10):
+        self.directory = directory
+        self.max_memory_items = max_memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self.max_age = max_age
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def get_image(self, url, variant, prepare, count=None):
+        """
+        Return prepare(image) for the picture at url, or None if it can't be fetched.
+
+        variant identifies what prepare produces (e.g. size and colour mode), so
+        different tiles made from the same download are cached separately.
+        count(name) is called with the tier that served the image, e.g.
+        "memory_hit" or "download", so callers can keep hit counts.
+        """
+        count = count or ignore_count
+        image = self.get_fresh(url, variant, count)
+        if image is not None:
+            return image
+        key = (url, variant)
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+
+        meta = self.revalidate(url, count)
+        if meta is None:
+            return None
+        if entry is not None and entry["fetched_at"] == meta["fetched_at"]:
+            image = entry["image"]
+        else:
+            content_path, _ = self.paths(url)
+            try:
+                with open(content_path, "rb") as f:
+                    image = prepare(Image.open(io.BytesIO(f.read())))
+            except Exception as e:
+                logger.warning(f"Failed to prepare image from {url}: {e}")
+                count("failure")
+                return None
+
+        with self.lock:
+            self.memory[key] = {"image": image, "checked_at": now, "fetched_at": meta["fetched_at"]}
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_memory_items:
+                self.memory.popitem(last=False)
+        return image
+
+    def get_fresh(self, url, variant, count=None):
+        # The in-memory tile if it needs no revalidation, without any I/O
+        key = (url, variant)
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is None or time.time() - entry["checked_at"] >= self.max_age:
+                return None
+            self.memory.move_to_end(key)
+        (count or ignore_count)("memory_hit")
+        return entry["image"]
+
+    def revalidate(self, url, count=None):
+        """
+        Make sure the disk copy of url is fresh and return its metadata.
+
+        Fresh entries are used as they are, stale ones are revalidated with
+        If-None-Match/If-Modified-Since. If the server can't be reached a stale
+        copy is still returned. Returns None when there is nothing usable.
+        """
+        count = count or ignore_count
+        content_path, meta_path = self.paths(url)
+        meta = self.read_meta(meta_path) if os.path.exists(content_path) else None
+        now = time.time()
+
+        if meta is not None and now - meta["checked_at"] < self.max_age:
+            self.touch(content_path)
+            count("disk_hit")
+            return meta
+
+        headers = {}
+        if meta is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+            if response.status_code == 304 and meta is not None:
+                meta["checked_at"] = now
+                self.write_file(meta_path, json.dumps(meta).encode())
+                self.touch(content_path)
+                count("not_modified")
+                return meta
+            response.raise_for_status()
+        except Exception as e:
+            logger.warning(f"Failed to fetch image from {url}: {e}")
+            # A stale copy beats a missing tile
+            count("stale" if meta is not None else "failure")
+            return meta
+
+        meta = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "checked_at": now,
+            "fetched_at": now,
+        }
+        self.write_file(content_path, response.content)
+        self.write_file(meta_path, json.dumps(meta).encode())
+        self.evict()
+        count("download")
+        return meta
+
+    def paths(self, url):
+        name = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.directory, name + ".bin"), os.path.join(self.directory, name + ".json")
+
+    def read_meta(self, meta_path):
+        try:
+            with open(meta_path, "rb") as f:
+                return json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def touch(self, content_path):
+        # Eviction goes by mtime, so uses count as recent
+        try:
+            os.utime(content_path)
+        except OSError:
+            pass
+
+    def write_file(self, path, content):
+        # Other processes, like render workers, may share the directory
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "wb") as f:
+            f.write(content)
+        os.replace(temporary_path, path)
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".bin"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total_bytes <= self.max_disk_bytes:
+                break
+            for path in (name, name[:-len(".bin")] + ".json"):
+                try:
+                    os.remove(os.path.join(self.directory, path))
+                except OSError:
+                    pass
+            total_bytes -= size